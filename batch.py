@@ -0,0 +1,189 @@
+# batch.py
+"""폴더 안의 RFP(PDF/TXT)를 화면 없이 한꺼번에 분석하는 배치 실행기.
+
+문서마다 추출 → 정제 → 인덱싱 → 사업 개요 → 리스크 → KSF → 목차를 수행하고, 문서 단위로 프로세스 풀에 나누어 실행한다.
+인덱스와 단계별 결과는 앱과 같은 디스크 캐시(.cache)에 저장되고, 보고서는 출력 폴더에 문서별로 기록되어
+Streamlit 앱의 "미리 분석된 문서 열기"에서 바로 불러올 수 있다.
+
+    python batch.py ./rfps --workers 4 --llm-concurrency 8 --llm-tpm 30000
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pipeline
+from index_store import document_fingerprint
+from instrumentation import set_session
+
+BATCH_OUTPUT_DIR = os.getenv("RFP_BATCH_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_results")
+RESULT_FILE = "result.json"
+FILE_TYPES = {".pdf": "application/pdf", ".txt": "text/plain"}
+
+logger = logging.getLogger("rfp.batch")
+
+
+def _write_text(path, text):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(llm_concurrency, llm_tpm):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(name)s: %(message)s")
+    pipeline.set_llm_concurrency(llm_concurrency)
+    pipeline.set_llm_rate_limit(llm_tpm)
+
+
+def analyze_document(path, output_dir=BATCH_OUTPUT_DIR, force=False):
+    """문서 하나를 끝까지 분석하여 출력 폴더에 기록하고 처리 결과 요약을 반환."""
+    started = time.perf_counter()
+    file_name = os.path.basename(path)
+    ext = os.path.splitext(file_name)[1]
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    source_hash = hashlib.sha256(file_bytes).hexdigest()
+    # 확장자까지 포함한 파일명으로 폴더를 나누어 a.pdf와 a.txt가 같은 결과 폴더를 쓰지 않도록 함
+    result_dir = os.path.join(output_dir, file_name)
+    result_path = os.path.join(result_dir, RESULT_FILE)
+    if not force and os.path.exists(result_path):
+        with open(result_path, encoding="utf-8") as f:
+            if json.load(f).get("source_hash") == source_hash:
+                return {"file_name": file_name, "status": "skipped", "result_dir": result_dir}
+
+    set_session(f"batch:{file_name}")
+    file_type = FILE_TYPES[ext.lower()]
+    # 문서 단위로 이미 프로세스를 나누었으므로 PDF 페이지 추출은 워커 안에서 순차로 수행
+    raw_text = pipeline.extract_raw_text(file_bytes, file_type, pdf_workers=1)
+    if not raw_text or not raw_text.strip():
+        raise ValueError("추출된 텍스트가 없습니다.")
+    failed_windows = []
+    refined_text = raw_text
+    if file_type == "application/pdf":
+        refined_text, failed = pipeline.refine_text(raw_text)
+        failed_windows = [n for n, _ in failed]
+        if failed:
+            logger.warning("[%s] %d개 구간 정제 실패, 원본 텍스트 사용: %s", file_name, len(failed), failed[0][1])
+
+    doc_fingerprint = document_fingerprint(refined_text)
+    vector_db = pipeline.create_vector_db(refined_text)
+    project_summary, stage_contexts, errors, _ = pipeline.run_upload_pipeline(vector_db, doc_fingerprint)
+    if "summary" in errors:
+        raise errors["summary"]
+    # 앱의 단계 버튼과 같은 캐시 키로 저장되므로, 같은 파일을 앱에 올려도 LLM 호출 없이 바로 표시됨
+    reports = {}
+    reports["risk"] = pipeline.generate_risk_report(vector_db, doc_fingerprint, context=stage_contexts.get("risk"))
+    reports["ksf"] = pipeline.generate_ksf_report(
+        vector_db, doc_fingerprint, reports["risk"], context=stage_contexts.get("ksf")
+    )
+    reports["outline"] = pipeline.generate_outline_report(
+        vector_db, doc_fingerprint, project_summary, reports["risk"], reports["ksf"], context=stage_contexts.get("outline")
+    )
+
+    os.makedirs(result_dir, exist_ok=True)
+    _write_text(os.path.join(result_dir, "raw.txt"), raw_text)
+    _write_text(os.path.join(result_dir, "refined.txt"), refined_text)
+    _write_text(os.path.join(result_dir, "summary.md"), project_summary)
+    for stage, report in reports.items():
+        _write_text(os.path.join(result_dir, f"{stage}.md"), report)
+    seconds = round(time.perf_counter() - started, 2)
+    # result.json은 마지막에 기록하여, 이 파일이 있으면 나머지 결과도 모두 있다고 볼 수 있도록 함
+    _write_text(result_path, json.dumps({
+        "file_name": file_name,
+        "file_type": file_type,
+        "source_hash": source_hash,
+        "doc_fingerprint": doc_fingerprint,
+        "project_summary": project_summary,
+        "reports": reports,
+        "failed_windows": failed_windows,
+        "seconds": seconds,
+        "analyzed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, ensure_ascii=False, indent=2))
+    return {"file_name": file_name, "status": "done", "seconds": seconds, "result_dir": result_dir}
+
+
+def list_batch_results(output_dir=BATCH_OUTPUT_DIR):
+    if not os.path.isdir(output_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(output_dir)
+        if os.path.exists(os.path.join(output_dir, name, RESULT_FILE))
+    )
+
+
+def load_batch_result(name, output_dir=BATCH_OUTPUT_DIR):
+    result_dir = os.path.join(output_dir, name)
+    with open(os.path.join(result_dir, RESULT_FILE), encoding="utf-8") as f:
+        result = json.load(f)
+    for key in ("raw", "refined"):
+        with open(os.path.join(result_dir, f"{key}.txt"), encoding="utf-8") as f:
+            result[f"{key}_text"] = f.read()
+    return result
+
+
+def find_documents(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if os.path.splitext(name)[1].lower() in FILE_TYPES
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RFP 문서 폴더 일괄 분석")
+    parser.add_argument("input_dir", help="PDF/TXT 파일이 들어 있는 폴더")
+    parser.add_argument("--output", default=BATCH_OUTPUT_DIR, help="문서별 결과를 저장할 폴더")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)), help="동시에 분석할 문서 수(프로세스 수)")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="전체 프로세스를 합친 동시 LLM 요청 수 상한")
+    parser.add_argument("--llm-tpm", type=int, default=pipeline.LLM_TOKENS_PER_MINUTE,
+                        help="전체 프로세스를 합친 분당 LLM 토큰 상한 (0이면 제한 없음)")
+    parser.add_argument("--force", action="store_true", help="이미 분석된 문서도 다시 분석")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(name)s: %(message)s")
+
+    paths = find_documents(args.input_dir)
+    if not paths:
+        print(f"{args.input_dir}에 분석할 PDF/TXT 파일이 없습니다.")
+        return 1
+    # 프로세스마다 LLM 요청 자리를 하나 이상 가져야 하므로 프로세스 수는 동시 LLM 요청 상한을 넘지 않음
+    workers = max(1, min(args.workers, len(paths), args.llm_concurrency))
+    # 프로세스마다 LLM 요청 수와 분당 토큰을 나누어 가져 전체 합이 상한을 넘지 않도록 함
+    llm_per_worker = max(1, args.llm_concurrency // workers)
+    tpm_per_worker = max(1, args.llm_tpm // workers) if args.llm_tpm > 0 else 0
+    print(f"{len(paths)}개 문서를 {workers}개 프로세스로 분석합니다. (프로세스당 동시 LLM 요청 {llm_per_worker}개)")
+
+    started = time.perf_counter()
+    outcomes = []
+    # 워커가 부모 프로세스의 SQLite 연결이나 스레드를 물려받지 않도록 spawn으로 시작
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker, initargs=(llm_per_worker, tpm_per_worker)
+    ) as executor:
+        futures = {executor.submit(analyze_document, path, args.output, args.force): path for path in paths}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_name = os.path.basename(futures[future])
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {"file_name": file_name, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+            outcomes.append(outcome)
+            detail = outcome.get("error") or (f"{outcome['seconds']}s" if "seconds" in outcome else "")
+            print(f"[{done}/{len(paths)}] {file_name}: {outcome['status']} {detail}".rstrip())
+
+    failed = [o for o in outcomes if o["status"] == "failed"]
+    os.makedirs(args.output, exist_ok=True)
+    _write_text(os.path.join(args.output, "batch_summary.json"), json.dumps({
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": round(time.perf_counter() - started, 2),
+        "documents": outcomes,
+    }, ensure_ascii=False, indent=2))
+    print(f"완료: {len(outcomes) - len(failed)}개 성공, {len(failed)}개 실패 ({time.perf_counter() - started:.1f}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
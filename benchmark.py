@@ -0,0 +1,568 @@
+# benchmark.py
+"""OpenAI를 호출하지 않고 pipeline.py의 단계별 소요 시간과 메모리를 측정하는 오프라인 벤치마크.
+
+ChatOpenAI / OpenAIEmbeddings 대신 결정적인(deterministic) 가짜 모델을 주입하고, 지연 시간은 옵션으로 흉내낸다.
+
+    python benchmark.py --pages 10 100 1000 --output bench.json
+    python benchmark.py --pages 10 100 --llm-latency 0.8 --compare bench.json
+    python benchmark.py --pages 10 --gateway --gateway-sessions 8 --server-error-rate 0.1
+
+--gateway는 OpenAI 호환 로컬 대역(stand-in) 서버를 띄우고 실제 ChatOpenAI가 LLM 게이트웨이를 거쳐 HTTP로 요청하도록 하여,
+여러 세션이 같은 단계를 동시에 실행할 때의 요청 병합, 동시 요청 상한, 429 재시도, 연결 재사용을 측정한다.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import zlib
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import fitz
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_PAGES = [10, 100, 1000]
+
+SECTION_TITLES = [
+    "사업 개요", "추진 배경 및 필요성", "사업 범위", "제안 요청 내용", "기능 요구사항",
+    "성능 요구사항", "보안 요구사항", "데이터 요구사항", "품질 요구사항", "프로젝트 관리 요구사항",
+    "제안서 평가 기준", "계약 조건",
+]
+REQUIREMENT_PREFIXES = ["SFR", "PER", "SER", "DAR", "QUR", "PMR"]
+SENTENCES = [
+    "수요기관은 기존 시스템의 노후화로 인한 장애 위험을 해소하고자 한다.",
+    "제안사는 클라우드 네이티브 아키텍처 기반으로 시스템을 구축하여야 한다.",
+    "모든 개인정보는 암호화하여 저장하고 접근 이력을 기록하여야 한다.",
+    "기존 데이터는 무결성 검증을 거쳐 신규 시스템으로 이관하여야 한다.",
+    "응답 시간은 동시 사용자 1,000명 기준 3초 이내를 만족하여야 한다.",
+    "사업 수행 중 요구사항 변경은 변경관리 절차에 따라 처리한다.",
+    "제안사는 착수 후 30일 이내에 상세 수행계획서를 제출하여야 한다.",
+    "하자보수 기간은 검수 완료일로부터 1년으로 한다.",
+]
+
+
+# --- 가짜 모델 ---------------------------------------------------------------
+
+def fake_response(prompt, report_items=8):
+    if "[OCR 추출 원본 텍스트]" in prompt:
+        # 정제 프롬프트는 원문을 그대로 돌려주어 이후 단계가 실제와 비슷한 분량을 처리하도록 함
+        return prompt.split("[OCR 추출 원본 텍스트]", 1)[1].split("\n---\n", 1)[0].strip()
+    if "[수정 대상 항목]" in prompt:
+        item = prompt.split("[수정 대상 항목]", 1)[1].split("\n---\n", 1)[0].strip()
+        return item + "\n    *   **보완:** 요청에 따라 근거와 수행 방안을 구체화함."
+    rng = random.Random(hashlib.md5(prompt.encode("utf-8")).hexdigest())
+    items = [
+        f"*   **{i}. 가상 분석 항목 {rng.randint(100, 999)}**\n"
+        f"    *   **근거:** {rng.choice(SENTENCES)}\n"
+        f"    *   **영향:** {rng.choice(SENTENCES)}\n"
+        f"    *   **해결 방안:** {rng.choice(SENTENCES)}"
+        for i in range(1, report_items + 1)
+    ]
+    return "\n\n".join(["## 가상 분석 결과"] + items)
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """ChatOpenAI와 같은 인자로 생성할 수 있는 결정적 가짜 채팅 모델."""
+
+    model: str = "fake-gpt"
+    temperature: float = 0.0
+    openai_api_key: Optional[str] = None
+    stream_usage: bool = False
+    latency: float = 0.0  # 요청당 첫 토큰까지의 지연(초)
+    token_latency: float = 0.0  # 토큰 사이 지연(초)
+    report_items: int = 8
+
+    @property
+    def _llm_type(self):
+        return "fake-chat-openai"
+
+    def _respond(self, messages):
+        return fake_response(messages[-1].content, self.report_items)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        text = self._respond(messages)
+        time.sleep(self.token_latency * len(text.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in re.split(r"(?<=\s)", self._respond(messages)):
+            if not token:
+                continue
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeOpenAIEmbeddings(Embeddings):
+    """문자 bigram 해싱으로 결정적 벡터를 만드는 가짜 임베딩 모델 (비슷한 텍스트는 비슷한 벡터)."""
+
+    def __init__(self, api_key=None, model="fake-embedding", size=256, latency=0.0, batch_size=1000):
+        self.model = model
+        self.size = size
+        self.latency = latency
+        self.batch_size = batch_size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        compact = re.sub(r"\s+", "", text)
+        for i in range(len(compact) - 1):
+            vector[zlib.crc32(compact[i:i + 2].encode("utf-8")) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            time.sleep(self.latency)
+            vectors.extend(self._embed(text) for text in texts[i:i + self.batch_size])
+        return vectors
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+# --- 로컬 대역(stand-in) OpenAI 서버 ---------------------------------------------
+
+class StandInOpenAIServer:
+    """/v1/chat/completions만 흉내내는 OpenAI 호환 로컬 서버 (일반 응답과 SSE 스트리밍 모두 지원).
+
+    error_rate 비율만큼(rate_limit_next로 지정한 다음 요청들은 반드시) 429(retry-after-ms 포함)를 돌려주고,
+    요청 수/429 수/최대 동시 요청 수/TCP 연결 수를 센다.
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._forced_rate_limits = 0
+        self.take_stats()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_port}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def rate_limit_next(self, count):
+        # 무작위 비율과 관계없이 재시도 경로를 반드시 거치도록 다음 count개 요청에 429를 돌려줌
+        with self._lock:
+            self._forced_rate_limits = count
+
+    def take_stats(self):
+        with self._lock:
+            stats = getattr(self, "stats", None)
+            self.stats = {"requests": 0, "rate_limited": 0, "max_concurrency": 0, "connections": 0}
+        return stats
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive: 클라이언트가 연결을 재사용하는지 확인
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.stats["connections"] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                try:
+                    server._handle(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 스트림을 받던 쪽이 모두 떠나 연결을 끊은 경우
+                    self.close_connection = True
+
+        return Handler
+
+    def _handle(self, handler, body):
+        from retrieval import count_tokens
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self._active += 1
+            self.stats["max_concurrency"] = max(self.stats["max_concurrency"], self._active)
+            rate_limited = self._forced_rate_limits > 0 or self._rng.random() < self.error_rate
+            if self._forced_rate_limits:
+                self._forced_rate_limits -= 1
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+        try:
+            if rate_limited:
+                error = {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}}
+                self._send_json(handler, 429, error, {"retry-after-ms": "100"})
+                return
+            time.sleep(self.latency)
+            prompt = body["messages"][-1]["content"]
+            text = fake_response(prompt)
+            prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+            base = {"id": f"chatcmpl-{self.stats['requests']}", "created": int(time.time()), "model": body["model"]}
+            if not body.get("stream"):
+                self._send_json(handler, 200, {
+                    **base, "object": "chat.completion", "usage": usage,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                })
+                return
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Transfer-Encoding", "chunked")
+            handler.end_headers()
+            chunk = {**base, "object": "chat.completion.chunk"}
+            self._send_event(handler, {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]})
+            for token in re.split(r"(?<=\s)", text):
+                if token:
+                    time.sleep(self.token_latency)
+                    self._send_event(handler, {**chunk, "choices": [{"index": 0, "delta": {"content": token}}]})
+            self._send_event(handler, {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._send_event(handler, {**chunk, "choices": [], "usage": usage})
+            self._write_chunk(handler, b"data: [DONE]\n\n")
+            handler.wfile.write(b"0\r\n\r\n")
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    @staticmethod
+    def _send_json(handler, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    @staticmethod
+    def _write_chunk(handler, data):
+        handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        handler.wfile.flush()
+
+    def _send_event(self, handler, payload):
+        self._write_chunk(handler, f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+
+# --- 합성 RFP ----------------------------------------------------------------
+
+def synthetic_rfp_pages(pages, seed=0):
+    rng = random.Random(seed)
+    page_texts = []
+    requirement_no = 0
+    for page_no in range(1, pages + 1):
+        lines = []
+        if page_no == 1:
+            lines += [
+                "제안요청서",
+                "사업명: 차세대 통합 행정정보시스템 구축 사업",
+                "사업기간: 계약일로부터 18개월",
+                f"사업예산: {rng.randint(10, 90)},{rng.randint(100, 999)},000,000원 (부가가치세 포함)",
+            ]
+        if page_no % 5 == 1:
+            section = SECTION_TITLES[(page_no // 5) % len(SECTION_TITLES)]
+            lines.append(f"제{page_no // 5 + 1}장 {section}")
+        for _ in range(4):
+            requirement_no += 1
+            prefix = REQUIREMENT_PREFIXES[requirement_no % len(REQUIREMENT_PREFIXES)]
+            lines += [
+                f"요구사항 고유번호: {prefix}-{requirement_no:03d}",
+                f"요구사항 명칭: {rng.choice(SECTION_TITLES)} 세부 항목 {requirement_no}",
+                "세부 내용: " + " ".join(rng.sample(SENTENCES, 3)),
+            ]
+        lines.append(f"- {page_no} -")
+        page_texts.append("\n".join(lines))
+    return page_texts
+
+
+def build_pdf(page_texts):
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, page.rect.width - 40, page.rect.height - 40), text, fontname="korea", fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+# --- 측정 --------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.results = []
+
+    @contextmanager
+    def measure(self, pages, stage, **extra):
+        if self.track_memory:
+            tracemalloc.start()
+        record = {"pages": pages, "stage": stage, **extra}
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            if self.track_memory:
+                record["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+                tracemalloc.stop()
+            self.results.append(record)
+            print(f"  {stage:<36} {record['seconds']:>9.3f}s" + (f" {record['peak_mb']:>9.1f}MB" if "peak_mb" in record else ""))
+
+
+def run_size(pipeline, recorder, pages):
+    from index_store import document_fingerprint
+    from retrieval import hybrid_search
+    from rfp_structure import RfpStructure
+    from prompts import RISK_ANALYSIS_PROMPT
+
+    print(f"[{pages} pages]")
+    page_texts = synthetic_rfp_pages(pages)
+    pdf_bytes = build_pdf(page_texts)
+    text_bytes = "\n\n".join(page_texts).encode("utf-8")
+
+    with recorder.measure(pages, "iter_pdf_pages") as record:
+        record["page_count"] = sum(1 for _ in pipeline.iter_pdf_pages(pdf_bytes))
+    with recorder.measure(pages, "extract_text_from_file[pdf]"):
+        raw_text = pipeline.extract_raw_text(pdf_bytes, "application/pdf")
+        refined_text, _ = pipeline.refine_text(raw_text)
+    with recorder.measure(pages, "extract_text_from_file[txt]"):
+        pipeline.extract_raw_text(text_bytes, "text/plain")
+    if not refined_text:
+        raise RuntimeError("텍스트 추출 결과가 비어 있습니다.")
+
+    with recorder.measure(pages, "chunking") as record:
+        record["chunks"] = len(pipeline.split_text_into_chunks(refined_text))
+    with recorder.measure(pages, "create_vector_db[cold]"):
+        vector_db = pipeline.create_vector_db(refined_text)
+    if vector_db is None:
+        raise RuntimeError("벡터 DB 생성에 실패했습니다.")
+    with recorder.measure(pages, "create_vector_db[memory]"):
+        pipeline.create_vector_db(refined_text)
+    pipeline.get_index_store.cache_clear()
+    with recorder.measure(pages, "create_vector_db[disk]"):
+        vector_db = pipeline.create_vector_db(refined_text)
+
+    queries = ["사업명 사업기간 사업예산", "SFR-001 요구사항", "보안 요구사항 개인정보 암호화", "제안서 평가 기준"]
+    with recorder.measure(pages, "retrieval[hybrid]", queries=len(queries)):
+        for query in queries:
+            hybrid_search(vector_db, query, k=10)
+    risk_question = pipeline.STAGE_QUERIES["risk"]["question"]
+    with recorder.measure(pages, "retrieve_stage_context[hyde]"):
+        context = pipeline.retrieve_stage_context(vector_db, risk_question, use_hyde=True)
+    with recorder.measure(pages, "retrieve_stage_context[no_hyde]"):
+        pipeline.retrieve_stage_context(vector_db, risk_question, use_hyde=False)
+    with recorder.measure(pages, "structure_parse") as record:
+        structure = RfpStructure.parse(refined_text)
+        record.update(sections=len(structure.sections), requirements=len(structure.requirements))
+    with recorder.measure(pages, "structured_context") as record:
+        record["found"] = pipeline.structured_context(vector_db, pipeline.STAGE_QUERIES["risk"]["topics"], 6000) is not None
+
+    with recorder.measure(pages, "run_analysis_with_inputs"):
+        report = pipeline.run_analysis_with_inputs(vector_db, RISK_ANALYSIS_PROMPT, risk_question, {}, context=context)
+    with recorder.measure(pages, "run_analysis_with_inputs[stream]") as record:
+        started = time.perf_counter()
+        for token in pipeline.run_analysis_with_inputs(vector_db, RISK_ANALYSIS_PROMPT, risk_question, {}, context=context, stream=True):
+            record.setdefault("ttft", round(time.perf_counter() - started, 4))
+    with recorder.measure(pages, "run_upload_pipeline"):
+        pipeline.run_upload_pipeline(vector_db, document_fingerprint(refined_text))
+
+    long_report = "\n\n".join([report] * max(1, pages // 10))
+    with recorder.measure(pages, "parse_report_items", repeat=100):
+        for _ in range(100):
+            pipeline.parse_report_items(long_report)
+    with recorder.measure(pages, "refine_report_with_chat"):
+        pipeline.refine_report_with_chat(vector_db, report, "보고서 전체를 더 간결하게 다듬어줘")
+    with recorder.measure(pages, "refine_report_items_with_chat"):
+        pipeline.refine_report_items_with_chat(vector_db, report, "2번 항목의 해결 방안을 보강해줘")
+
+
+def run_gateway(pipeline, recorder, args, pages=10):
+    """로컬 대역 서버를 상대로 실제 ChatOpenAI가 게이트웨이를 거쳐 요청하도록 하여 여러 세션의 동시 실행을 측정.
+
+    병합/동시 요청 상한/429 재시도 확인에 실패한 항목 목록을 반환.
+    """
+    from langchain_openai import ChatOpenAI
+    from index_store import document_fingerprint
+    from instrumentation import set_session
+    from prompts import RISK_ANALYSIS_PROMPT
+
+    sessions = args.gateway_sessions
+    print(f"[gateway: {sessions} sessions, {pages} pages]")
+    # 크기별 측정과 다른 문서를 사용하여 단계별 결과 캐시가 섞이지 않도록 함
+    refined_text = "\n\n".join(synthetic_rfp_pages(pages, seed=1))
+    vector_db = pipeline.create_vector_db(refined_text)
+    doc_fingerprint = document_fingerprint(refined_text)
+    risk_question = pipeline.STAGE_QUERIES["risk"]["question"]
+    context = pipeline.retrieve_stage_context(vector_db, risk_question, use_hyde=False)
+
+    fake_chat = pipeline.ChatOpenAI
+    with StandInOpenAIServer(args.server_latency, args.token_latency, args.server_error_rate) as server:
+        pipeline.ChatOpenAI = ChatOpenAI
+        pipeline.LLM_BASE_URL = server.base_url
+        pipeline.set_api_key("stand-in")
+        pipeline._cached_chat_llm.cache_clear()
+        try:
+            def run_stage(i):
+                set_session(f"bench-{i}")
+                return "".join(pipeline.generate_risk_report(vector_db, doc_fingerprint, stream=True))
+
+            # 같은 문서의 리스크 단계를 여러 세션이 동시에 스트리밍: HyDE와 생성 요청이 한 번씩만 서버에 도달해야 함
+            with recorder.measure(pages, "gateway[same_stage]", sessions=sessions) as record:
+                with ThreadPoolExecutor(max_workers=sessions) as executor:
+                    reports = list(executor.map(run_stage, range(sessions)))
+                record.update(server.take_stats(), identical_reports=len(set(reports)) == 1)
+
+            def run_distinct(i):
+                set_session(f"bench-{i % sessions}")
+                return pipeline.run_analysis_with_inputs(
+                    vector_db, RISK_ANALYSIS_PROMPT, risk_question, {}, context=f"{context}\n(요청 {i})"
+                )
+
+            # 서로 다른 요청을 동시 상한보다 많이 보냄: 서버의 최대 동시 요청 수가 상한 이하이고 429는 재시도로 모두 성공해야 함
+            requests = sessions * 4
+            server.rate_limit_next(2)
+            with recorder.measure(pages, "gateway[distinct]", sessions=sessions, calls=requests) as record:
+                with ThreadPoolExecutor(max_workers=requests) as executor:
+                    list(executor.map(run_distinct, range(requests)))
+                stats = server.take_stats()
+                # 요청마다 한 번씩 성공하므로 호출 수를 넘는 서버 요청은 모두 429 이후의 재시도
+                record.update(stats, retries=stats["requests"] - requests, concurrency_limit=pipeline.llm_gateway.slots.limit)
+        finally:
+            pipeline.ChatOpenAI = fake_chat
+            pipeline.LLM_BASE_URL = None
+            pipeline._cached_chat_llm.cache_clear()
+    for record in recorder.results[-2:]:
+        print(f"    {record['stage']}: 요청 {record['requests']}회, 429 {record['rate_limited']}회, "
+              f"최대 동시 요청 {record['max_concurrency']}, 연결 {record['connections']}개")
+
+    same_stage, distinct = recorder.results[-2:]
+    failures = []
+    if not same_stage["identical_reports"]:
+        failures.append("병합된 세션들의 보고서가 서로 다름")
+    if distinct["max_concurrency"] > distinct["concurrency_limit"]:
+        failures.append(f"최대 동시 요청 {distinct['max_concurrency']}이 상한 {distinct['concurrency_limit']}을 넘음")
+    if not distinct["rate_limited"] or distinct["retries"] != distinct["rate_limited"]:
+        failures.append(f"429 {distinct['rate_limited']}회에 재시도 {distinct['retries']}회")
+    return failures
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["pages"], r["stage"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\n{'pages':>6} {'stage':<36} {'before':>9} {'after':>9} {'ratio':>7}")
+    for record in results:
+        previous = baseline.get((record["pages"], record["stage"]))
+        if not previous:
+            continue
+        ratio = record["seconds"] / previous["seconds"] if previous["seconds"] else float("inf")
+        flag = " !" if ratio > threshold else ""
+        print(f"{record['pages']:>6} {record['stage']:<36} {previous['seconds']:>8.3f}s {record['seconds']:>8.3f}s {ratio:>6.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RFP 분석 파이프라인 오프라인 벤치마크")
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES, help="합성 RFP 페이지 수 목록")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="LLM 요청당 지연(초)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="LLM 토큰당 지연(초)")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="임베딩 배치당 지연(초)")
+    parser.add_argument("--llm-concurrency", type=int, help="LLM 게이트웨이 동시 요청 상한 (기본: RFP_LLM_CONCURRENCY)")
+    parser.add_argument("--llm-tpm", type=int, default=0, help="LLM 게이트웨이 분당 토큰 상한 (기본 0: 제한 없음)")
+    parser.add_argument("--gateway", action="store_true", help="로컬 대역 서버로 LLM 게이트웨이(병합/동시성/재시도) 측정")
+    parser.add_argument("--gateway-sessions", type=int, default=8, help="--gateway 시 동시에 실행할 세션 수")
+    parser.add_argument("--server-latency", type=float, default=0.2, help="대역 서버의 요청당 지연(초)")
+    parser.add_argument("--server-error-rate", type=float, default=0.1, help="대역 서버가 429를 돌려줄 비율")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc 기반 메모리 측정을 끔(측정 오버헤드 제거)")
+    parser.add_argument("--output", default="bench_results.json", help="결과 JSON 경로")
+    parser.add_argument("--compare", help="비교할 이전 결과 JSON 경로")
+    parser.add_argument("--threshold", type=float, default=1.2, help="--compare 시 회귀로 판단할 배율")
+    args = parser.parse_args(argv)
+
+    # 이전 실행의 디스크 캐시가 측정에 섞이지 않도록 pipeline import 전에 임시 캐시 폴더를 지정
+    os.environ["RFP_CACHE_DIR"] = tempfile.mkdtemp(prefix="rfp-bench-")
+    import pipeline
+
+    pipeline.ChatOpenAI = lambda **kwargs: FakeChatOpenAI(latency=args.llm_latency, token_latency=args.token_latency, **kwargs)
+    pipeline.OpenAIEmbeddings = lambda **kwargs: FakeOpenAIEmbeddings(latency=args.embedding_latency, **kwargs)
+    # 측정 시간이 TPM 대기에 좌우되지 않도록 기본적으로 분당 토큰 상한을 끔
+    pipeline.set_llm_rate_limit(args.llm_tpm)
+    if args.llm_concurrency:
+        pipeline.set_llm_concurrency(args.llm_concurrency)
+
+    recorder = Recorder(track_memory=not args.no_memory)
+    for pages in args.pages:
+        run_size(pipeline, recorder, pages)
+    failures = run_gateway(pipeline, recorder, args) if args.gateway else []
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "args": vars(args),
+        },
+        "results": recorder.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\n결과를 {args.output}에 저장했습니다.")
+
+    if failures:
+        print(f"\n게이트웨이 확인 실패: {'; '.join(failures)}")
+        return 1
+
+    if args.compare:
+        regressions = compare(recorder.results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)}개 단계가 {args.threshold}배 이상 느려졌습니다.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
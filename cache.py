@@ -0,0 +1,274 @@
+# cache.py
+import os
+import time
+import sqlite3
+import json
+import hashlib
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from instrumentation import record_cache, record_embedding
+from retrieval import count_tokens
+
+CACHE_DIR = os.getenv("RFP_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("RFP_EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RFP_RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+OCR_CACHE_MAX_BYTES = int(os.getenv("RFP_OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+SQLITE_BATCH_SIZE = 500  # SQLite 바인딩 변수 개수 제한을 넘지 않도록 나누어 조회
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _batched(items, size=SQLITE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class EmbeddingCache:
+    """chunk 텍스트 + 임베딩 모델명 해시를 키로 벡터를 보관하는 디스크(SQLite) 캐시.
+
+    전체 크기가 max_bytes를 넘으면 가장 오래 사용되지 않은 벡터부터 삭제한다.
+    """
+
+    def __init__(self, path=None, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path or os.path.join(CACHE_DIR, "embeddings.sqlite3")
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+
+    @staticmethod
+    def make_key(text, model_name):
+        return content_hash(model_name, text)
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for batch in _batched(list(keys)):
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if rows:
+                    hit_keys = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys],
+                    )
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 한도의 90%까지 비워서 매번 삭제가 반복되지 않도록 함
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used")
+        victims = []
+        for key, size in cursor:
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size
+        for batch in _batched(victims):
+            self._conn.execute(f"DELETE FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+
+
+class CachedEmbeddings(Embeddings):
+    """EmbeddingCache에 없는 chunk만 실제 임베딩 모델로 계산하는 Embeddings 래퍼."""
+
+    def __init__(self, embeddings, cache, model_name=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name or getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts):
+        keys = [EmbeddingCache.make_key(text, self.model_name) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        record_cache(True, len(keys) - len(missing))
+        record_cache(False, len(missing))
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = [missing[key] for key in missing_keys]
+            started = time.perf_counter()
+            new_vectors = self.embeddings.embed_documents(missing_texts)
+            record_embedding(self.model_name, sum(count_tokens(text) for text in missing_texts), time.perf_counter() - started)
+            self.cache.put_many(zip(missing_keys, new_vectors))
+            vectors.update(zip(missing_keys, new_vectors))
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        started = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        record_embedding(self.model_name, count_tokens(text), time.perf_counter() - started)
+        return vector
+
+
+class ResultCache:
+    """문서 fingerprint + 프롬프트 템플릿 해시 + 모델/temperature + 입력값을 키로 단계별 분석 결과를 보관하는 디스크 캐시."""
+
+    def __init__(self, path=None, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = path or os.path.join(CACHE_DIR, "results.sqlite3")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, document TEXT NOT NULL, stage TEXT NOT NULL, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_document ON results(document)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+
+    @staticmethod
+    def make_key(document_fingerprint, stage, prompt_templates, model, temperature, inputs=None):
+        template_hashes = [content_hash(template) for template in prompt_templates]
+        inputs_hash = content_hash(json.dumps(inputs or {}, ensure_ascii=False, sort_keys=True))
+        return content_hash(document_fingerprint, stage, *template_hashes, model, temperature, inputs_hash)
+
+    def get(self, key):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, document_fingerprint, stage, value):
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, document, stage, value, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, document_fingerprint, stage, value, size, time.time()),
+            )
+            self._evict()
+
+    def invalidate(self, document_fingerprint=None, stage=None):
+        conditions, params = [], []
+        if document_fingerprint:
+            conditions.append("document = ?")
+            params.append(document_fingerprint)
+        if stage:
+            conditions.append("stage = ?")
+            params.append(stage)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock, self._conn:
+            return self._conn.execute(f"DELETE FROM results{where}", params).rowcount
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size
+        for batch in _batched(victims):
+            self._conn.execute(f"DELETE FROM results WHERE key IN ({','.join('?' * len(batch))})", batch)
+
+
+class OcrCache:
+    """페이지 이미지 해시 + OCR 언어를 키로 OCR 결과 텍스트를 보관하는 디스크 캐시.
+
+    OCR 워커 프로세스마다 따로 연결을 열어 사용한다.
+    """
+
+    def __init__(self, path=None, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path or os.path.join(CACHE_DIR, "ocr.sqlite3")
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_last_used ON ocr(last_used)")
+
+    @staticmethod
+    def make_key(image_bytes, languages):
+        return content_hash("ocr", hashlib.sha256(image_bytes).hexdigest(), languages)
+
+    def get(self, key):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE ocr SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, text):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, len(text.encode("utf-8")), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM ocr ORDER BY last_used"):
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size
+        for batch in _batched(victims):
+            self._conn.execute(f"DELETE FROM ocr WHERE key IN ({','.join('?' * len(batch))})", batch)
@@ -0,0 +1,146 @@
+# index_store.py
+import os
+import json
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+import faiss
+from langchain_community.vectorstores import FAISS
+from cache import CACHE_DIR, content_hash
+
+INDEX_STORE_DIR = os.path.join(CACHE_DIR, "indexes")
+INDEX_MEMORY_MAX_BYTES = int(os.getenv("RFP_INDEX_MEMORY_MAX_BYTES", 1024 * 1024 * 1024))
+STRUCTURE_FILE = "structure.json"
+
+
+def document_fingerprint(text):
+    return content_hash("document", text)
+
+
+def estimate_index_bytes(vector_db):
+    index = vector_db.index
+    size = index.ntotal * index.d * 4
+    size += sum(len(doc.page_content.encode("utf-8")) for doc in vector_db.docstore._dict.values())
+    # 인덱스에 붙여 둔 BM25 색인과 문서 구조도 같은 객체와 함께 메모리에 남으므로 포함
+    lexical_index = getattr(vector_db, "_lexical_index", None)
+    if lexical_index is not None:
+        size += lexical_index.estimate_bytes()
+    structures = getattr(vector_db, "_rfp_structures", None) or {}
+    size += sum(structure.estimate_bytes() for structure in structures.values())
+    return size
+
+
+class IndexStore:
+    """문서 fingerprint별 FAISS 인덱스를 디스크에 저장하고, 바이트 한도의 LRU로 메모리에 유지하는 저장소.
+
+    settings(chunk 크기/겹침, chunk 메타데이터 형식, 임베딩 모델 등)가 다르면 같은 문서라도 다른 폴더에 저장하여
+    설정이 바뀐 뒤 이전 인덱스를 그대로 쓰지 않도록 한다.
+    """
+
+    def __init__(self, root=INDEX_STORE_DIR, max_bytes=INDEX_MEMORY_MAX_BYTES, settings=()):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.settings = tuple(settings)
+        self._entries = OrderedDict()  # fingerprint -> (vector_db, 추정 크기)
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, fingerprint):
+        return os.path.join(self.root, content_hash("index", fingerprint, *self.settings))
+
+    def contains(self, fingerprint):
+        with self._lock:
+            if fingerprint in self._entries:
+                return True
+        return os.path.exists(os.path.join(self._path(fingerprint), "index.faiss"))
+
+    def get(self, fingerprint, embeddings):
+        with self._lock:
+            if fingerprint in self._entries:
+                self._entries.move_to_end(fingerprint)
+                return self._entries[fingerprint][0]
+        path = self._path(fingerprint)
+        if not os.path.exists(os.path.join(path, "index.faiss")):
+            return None
+        vector_db = self._load(path, embeddings)
+        self._remember(fingerprint, vector_db)
+        return vector_db
+
+    def put(self, fingerprint, vector_db):
+        """인덱스를 저장하고 이후 사용할 인덱스를 반환. 다른 세션/프로세스가 먼저 저장했으면 저장된 인덱스를 반환."""
+        # 임시 폴더에 저장한 뒤 이름을 바꾸어, 저장 도중 읽는 쪽이 깨진 인덱스를 보지 않도록 함
+        path = self._path(fingerprint)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            vector_db.save_local(tmp_path)
+            # 폴더 이름 바꾸기는 대상 폴더가 비어 있지 않으면 실패하므로, 먼저 저장한 쪽의 인덱스를 지우지 않음
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            stored = self.get(fingerprint, vector_db.embedding_function)
+            if stored is None:
+                raise
+            return stored
+        self._remember(fingerprint, vector_db)
+        return vector_db
+
+    def get_structure(self, fingerprint):
+        # 인덱스와 같은 폴더에 저장된 문서 구조(절 트리, 요구사항 ID 표)를 dict로 반환
+        path = os.path.join(self._path(fingerprint), STRUCTURE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def put_structure(self, fingerprint, data):
+        path = self._path(fingerprint)
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, f"{STRUCTURE_FILE}.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(path, STRUCTURE_FILE))
+
+    def discard(self, fingerprint):
+        with self._lock:
+            entry = self._entries.pop(fingerprint, None)
+            if entry:
+                self._memory_bytes -= entry[1]
+        shutil.rmtree(self._path(fingerprint), ignore_errors=True)
+
+    def refresh(self, fingerprint):
+        # 메모리에 있는 인덱스에 BM25 색인/문서 구조를 붙인 뒤 크기를 다시 계산하여 한도에 반영
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry:
+                self._remember(fingerprint, entry[0])
+
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    @staticmethod
+    def _load(path, embeddings):
+        index_path = os.path.join(path, "index.faiss")
+        try:
+            # 가능하면 메모리 매핑으로 읽어 여러 인덱스가 적재돼도 RSS가 늘지 않도록 함
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = faiss.read_index(index_path)
+        # 이 저장소가 직접 만든 파일만 읽으므로 pickle 역직렬화를 허용
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    def _remember(self, fingerprint, vector_db):
+        size = estimate_index_bytes(vector_db)
+        with self._lock:
+            previous = self._entries.pop(fingerprint, None)
+            if previous:
+                self._memory_bytes -= previous[1]
+            self._entries[fingerprint] = (vector_db, size)
+            self._memory_bytes += size
+            # 방금 넣은 인덱스 하나는 한도를 넘더라도 유지
+            while self._memory_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted_size
@@ -0,0 +1,227 @@
+# instrumentation.py
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from langchain_core.callbacks import BaseCallbackHandler
+from retrieval import count_tokens
+
+METRICS_LOG_PATH = os.getenv("RFP_METRICS_LOG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "metrics.jsonl")
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+METRICS_LOG_BACKUPS = 5
+SESSION_HISTORY = 200  # 세션별로 사이드바에 보여줄 최근 단계 기록 수
+
+# 1M 토큰당 USD 가격 (입력, 출력). 임베딩 모델은 입력 가격만 사용
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+_current_session = contextvars.ContextVar("rfp_session", default=None)
+_current_stage = contextvars.ContextVar("rfp_stage", default=None)
+_lock = threading.Lock()
+_session_records = defaultdict(lambda: deque(maxlen=SESSION_HISTORY))
+_metrics_logger = None
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens=0):
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def set_session(session_id):
+    _current_session.set(session_id)
+
+
+def current_session():
+    return _current_session.get()
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    # 스레드 풀 작업에도 현재 세션/단계가 이어지도록 컨텍스트를 복사해서 실행
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _new_record(stage, fields):
+    return {
+        "ts": time.time(),
+        "session": _current_session.get(),
+        "stage": stage,
+        "seconds": 0.0,
+        "steps": {},
+        "llm_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "embedding_tokens": 0,
+        "cost_usd": 0.0,
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "llm_retries": 0,
+        "llm_coalesced": 0,
+        **fields,
+    }
+
+
+@contextmanager
+def track_stage(stage, **fields):
+    """단계 하나의 소요 시간, LLM/임베딩 토큰, 예상 비용, 캐시 적중 여부를 기록."""
+    record = _new_record(stage, fields)
+    token = _current_stage.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        _current_stage.reset(token)
+        _emit(record)
+
+
+@contextmanager
+def track_step(step):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_step(_current_stage.get(), step, time.perf_counter() - started)
+
+
+def annotate(**fields):
+    record = _current_stage.get()
+    if record is not None:
+        with _lock:
+            record.update(fields)
+
+
+def record_cache(hit, count=1):
+    record = _current_stage.get()
+    if record is None or not count:
+        return
+    with _lock:
+        record["cache_hits" if hit else "cache_misses"] += count
+
+
+def record_llm_event(field):
+    # LLM 게이트웨이의 재시도(llm_retries)와 진행 중인 요청에 합류한 횟수(llm_coalesced)
+    record = _current_stage.get()
+    if record is None:
+        return
+    with _lock:
+        record[field] += 1
+
+
+def record_embedding(model, tokens, seconds):
+    record = _current_stage.get()
+    if record is None:
+        return
+    with _lock:
+        record["embedding_tokens"] += tokens
+        record["cost_usd"] += estimate_cost(model, tokens)
+    _add_step(record, "embedding", seconds)
+
+
+def _add_step(record, step, seconds):
+    if record is None:
+        return
+    with _lock:
+        record["steps"][step] = round(record["steps"].get(step, 0.0) + seconds, 4)
+
+
+def session_records(session_id):
+    with _lock:
+        return list(_session_records.get(session_id, ()))
+
+
+def _emit(record):
+    record["cost_usd"] = round(record["cost_usd"], 6)
+    if record["session"] is not None:
+        with _lock:
+            _session_records[record["session"]].append(record)
+    _get_metrics_logger().info(json.dumps(record, ensure_ascii=False))
+
+
+def _get_metrics_logger():
+    # 여러 사용자의 기록을 모아 분석할 수 있도록 JSONL 파일에 한 줄씩 추가 (용량 초과 시 회전)
+    global _metrics_logger
+    with _lock:
+        if _metrics_logger is None:
+            os.makedirs(os.path.dirname(METRICS_LOG_PATH), exist_ok=True)
+            logger = logging.getLogger("rfp.metrics")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                METRICS_LOG_PATH, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _metrics_logger = logger
+    return _metrics_logger
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LLM 호출별 소요 시간과 토큰 사용량을 현재 단계 기록에 더하는 콜백 핸들러.
+
+    invoke/stream 호출 시 config의 tags 첫 번째 값을 단계 내 세부 구간 이름(hyde, generation 등)으로 사용한다.
+    """
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, invocation_params=None, metadata=None,
+                            **kwargs):
+        params = invocation_params or {}
+        prompt_text = "\n".join(str(message.content) for batch in messages for message in batch)
+        # LCEL 체인이 자동으로 붙이는 "seq:step:n" 같은 태그는 건너뜀
+        step = next((tag for tag in tags or [] if ":" not in tag), "llm")
+        with _lock:
+            self._runs[run_id] = {
+                "record": _current_stage.get(),
+                "step": step,
+                "model": params.get("model_name") or params.get("model") or (metadata or {}).get("ls_model_name", ""),
+                "started": time.perf_counter(),
+                "prompt_text": prompt_text,
+            }
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with _lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or run["record"] is None:
+            return
+        prompt_tokens, completion_tokens = self._token_usage(response, run["prompt_text"])
+        record = run["record"]
+        with _lock:
+            record["llm_calls"] += 1
+            record["prompt_tokens"] += prompt_tokens
+            record["completion_tokens"] += completion_tokens
+            record["cost_usd"] += estimate_cost(run["model"], prompt_tokens, completion_tokens)
+        _add_step(record, run["step"], time.perf_counter() - run["started"])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with _lock:
+            self._runs.pop(run_id, None)
+
+    @staticmethod
+    def _token_usage(response, prompt_text):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("prompt_tokens"):
+            return usage["prompt_tokens"], usage.get("completion_tokens", 0)
+        for generation in response.generations[0] if response.generations else []:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+        # 스트리밍 등으로 사용량이 오지 않으면 tiktoken으로 추정
+        output_text = "".join(generation.text for batch in response.generations for generation in batch)
+        return count_tokens(prompt_text), count_tokens(output_text)
+
+
+metrics_handler = MetricsCallbackHandler()
@@ -0,0 +1,289 @@
+# llm_gateway.py
+"""프로세스 안의 모든 세션이 함께 쓰는 LLM 요청 관문(gateway).
+
+- 동시 요청 수 상한: 자리가 나면 진행 중인 요청이 가장 적은 세션부터 배정하여 한 사용자가 자리를 독차지하지 않음
+- 분당 토큰(TPM) 상한: 요청마다 예상 토큰(프롬프트 + 출력 추정치)을 토큰 버킷에서 차감하고, 429를 받으면 모든 요청을 함께 멈춤
+- 재시도: 429/타임아웃/연결 오류/5xx는 지수 백오프 + 지터(Retry-After가 있으면 그만큼)로 다시 시도
+- 요청 병합: 같은 키의 요청이 진행 중이면 새로 보내지 않고 그 결과(스트림은 토큰)를 함께 받음
+"""
+import time
+import random
+import logging
+import itertools
+import threading
+import contextvars
+from concurrent.futures import Future
+from contextlib import contextmanager, closing, ExitStack
+import openai
+from instrumentation import current_session, track_step, record_llm_event
+
+logger = logging.getLogger(__name__)
+
+# APITimeoutError는 APIConnectionError의 하위 클래스, InternalServerError는 5xx 응답
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class FairSlots:
+    """동시 요청 자리. 기다리는 요청 중 진행 중인 요청이 가장 적은 세션에 먼저 자리를 줌 (같으면 먼저 온 순서)."""
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._cond = threading.Condition()
+        self._active = {}  # 세션 -> 진행 중인 요청 수
+        self._total = 0
+        self._waiting = []  # [(도착 순번, 세션)]
+        self._arrivals = itertools.count()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = max(1, limit)
+            self._cond.notify_all()
+
+    def _next_waiter(self):
+        return min(self._waiting, key=lambda waiter: (self._active.get(waiter[1], 0), waiter[0]))
+
+    @contextmanager
+    def hold(self, session):
+        with self._cond:
+            waiter = (next(self._arrivals), session)
+            self._waiting.append(waiter)
+            while self._total >= self.limit or self._next_waiter() is not waiter:
+                self._cond.wait()
+            self._waiting.remove(waiter)
+            self._active[session] = self._active.get(session, 0) + 1
+            self._total += 1
+            # 자리가 더 남아 있으면 다음 순서의 요청도 진행할 수 있도록 깨움
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._total -= 1
+                self._active[session] -= 1
+                if not self._active[session]:
+                    del self._active[session]
+                self._cond.notify_all()
+
+
+class TokenBucket:
+    """분당 토큰 상한. tokens_per_minute가 0이면 제한하지 않음."""
+
+    def __init__(self, tokens_per_minute):
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self.set_rate(tokens_per_minute)
+
+    def set_rate(self, tokens_per_minute):
+        with self._cond:
+            self.capacity = max(0, tokens_per_minute)
+            self.available = self.capacity
+            self._updated = time.monotonic()
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def acquire(self, tokens):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if not self.capacity:
+                        return
+                    self._refill(now)
+                    # 한 요청이 버킷 전체보다 크면 버킷이 가득 찼을 때 보냄
+                    needed = min(tokens, self.capacity)
+                    if self.available >= needed:
+                        self.available -= needed
+                        return
+                    wait = (needed - self.available) * 60 / self.capacity
+                self._cond.wait(wait)
+
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class _SharedStream:
+    """한 번 받은 스트림 조각을 여러 구독자에게 처음부터 차례로 전달."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+
+    def push(self, chunk):
+        # 구독자가 모두 떠났으면 False를 반환하여 생성을 중단하도록 함
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+            return self.subscribers > 0
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def subscribe(self):
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    pending = self.chunks[position:]
+                    done, error = self.done, self.error
+                position += len(pending)
+                yield from pending
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class LLMGateway:
+    """동시 요청/TPM 상한, 재시도, 요청 병합을 적용하여 LLM 호출을 실행."""
+
+    def __init__(self, max_concurrency, tokens_per_minute=0, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.slots = FairSlots(max_concurrency)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._inflight = {}  # 키 -> Future
+        self._inflight_streams = {}  # 키 -> _SharedStream
+
+    def configure(self, max_concurrency=None, tokens_per_minute=None):
+        if max_concurrency is not None:
+            self.slots.set_limit(max_concurrency)
+        if tokens_per_minute is not None:
+            self.tokens.set_rate(tokens_per_minute)
+
+    @contextmanager
+    def _admit(self, session, tokens):
+        with ExitStack() as stack:
+            with track_step("llm_wait"):
+                stack.enter_context(self.slots.hold(session))
+                self.tokens.acquire(tokens)
+            yield
+
+    def _backoff(self, error, attempt):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max) + random.uniform(0, self.backoff_base)
+        else:
+            # full jitter: 여러 요청이 같은 시각에 한꺼번에 재시도하지 않도록 0~상한 사이에서 무작위로 기다림
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(error, openai.RateLimitError):
+            # 한도를 넘었으므로 다른 요청도 함께 멈추어 429가 연달아 나지 않도록 함
+            self.tokens.pause(delay)
+        record_llm_event("llm_retries")
+        logger.warning("LLM 요청 실패(%s), %.1f초 후 재시도 (%d/%d)", type(error).__name__, delay, attempt + 1, self.max_retries)
+        time.sleep(delay)
+
+    def _call(self, fn, tokens):
+        session = current_session()
+        for attempt in itertools.count():
+            try:
+                with self._admit(session, tokens):
+                    return fn()
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                self._backoff(e, attempt)
+
+    def invoke(self, fn, tokens, key=None):
+        """fn()을 실행하여 결과를 반환. 같은 key의 요청이 진행 중이면 그 결과를 함께 받음."""
+        if key is None:
+            return self._call(fn, tokens)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            record_llm_event("llm_coalesced")
+            with track_step("llm_wait"):
+                return future.result()
+        try:
+            result = self._call(fn, tokens)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stream(self, make_stream, tokens, key=None):
+        """make_stream()이 내보내는 조각을 전달하는 제너레이터. 같은 key의 스트림이 진행 중이면 처음부터 함께 받음.
+
+        생성은 별도 스레드에서 진행되며, 구독자가 모두 스트림을 닫으면 중단된다.
+        """
+        with self._lock:
+            shared = self._inflight_streams.get(key) if key is not None else None
+            coalesced = shared is not None
+            if shared is None:
+                shared = _SharedStream()
+                shared.subscribers += 1
+                if key is not None:
+                    self._inflight_streams[key] = shared
+                # 생성 스레드에서도 현재 세션/단계 기록이 이어지도록 컨텍스트를 복사
+                threading.Thread(
+                    target=contextvars.copy_context().run, args=(self._produce, shared, make_stream, tokens, key),
+                    daemon=True
+                ).start()
+            else:
+                shared.subscribers += 1
+        if coalesced:
+            record_llm_event("llm_coalesced")
+        return shared.subscribe()
+
+    def _produce(self, shared, make_stream, tokens, key):
+        session = current_session()
+        error = None
+        try:
+            for attempt in itertools.count():
+                try:
+                    with self._admit(session, tokens), closing(make_stream()) as chunks:
+                        for chunk in chunks:
+                            if not shared.push(chunk):
+                                break
+                    break
+                except RETRYABLE_ERRORS as e:
+                    # 이미 일부 토큰을 내보낸 스트림은 이어 붙일 수 없으므로 재시도하지 않음
+                    if shared.chunks or attempt >= self.max_retries:
+                        raise
+                    self._backoff(e, attempt)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                if self._inflight_streams.get(key) is shared:
+                    del self._inflight_streams[key]
+            shared.finish(error)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
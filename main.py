@@ -1,42 +1,160 @@
 # main.py
+import uuid
 import streamlit as st
 from utils import (
-    extract_text_from_file, create_vector_db, extract_project_summary,
+    extract_text_from_file, create_vector_db, load_vector_db, run_upload_pipeline, add_to_workspace, add_text_to_workspace,
     generate_risk_report, generate_ksf_report, generate_outline_report,
-    refine_report_with_chat, parse_report_items
+    refine_report_with_chat, refine_report_items_with_chat, parse_report_items,
+    make_report_patch, apply_report_patch, get_result_cache, invalidate_cached_results,
+    STAGE_QUERIES
 )
+from index_store import document_fingerprint
+from instrumentation import set_session, session_records
+from batch import list_batch_results, load_batch_result
+from workspace import Workspace, workspace_fingerprint
 
 st.set_page_config(page_title="대화형 RFP 분석/전략 수립", layout="wide")
 st.title("대화형 RFP 분석 및 제안 전략 수립 🚀")
 
 # --- 세션 상태 초기화 (lock_states 제거) ---
+# 성능/비용 기록을 세션별로 모으기 위한 ID (새 파일 업로드로 세션 상태를 비워도 유지)
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+set_session(st.session_state.session_id)
 if 'stage' not in st.session_state:
     st.session_state.stage = 0
 if "reports" not in st.session_state:
     st.session_state.reports = {}
 if "active_tab_key" not in st.session_state:
     st.session_state.active_tab_key = 'risk'
+if "report_history" not in st.session_state:
+    st.session_state.report_history = {}
+
+def stage_options(stage):
+    # 업로드 시에는 기본 설정으로 미리 검색하므로, 설정이 바뀐 단계는 버튼을 누를 때 다시 검색
+    use_hyde = st.session_state.get(f"use_hyde_{stage}", STAGE_QUERIES[stage]["use_hyde"])
+    context = None
+    if use_hyde == STAGE_QUERIES[stage]["use_hyde"]:
+        context = st.session_state.get("stage_contexts", {}).get(stage)
+    return {"use_hyde": use_hyde, "context": context, "doc_ids": st.session_state.get("doc_ids")}
+
+def reset_session_state():
+    # 새 문서로 분석을 다시 시작할 때도 세션 ID와 워크스페이스 문서는 유지
+    kept = {key: st.session_state[key] for key in ("session_id", "workspace", "workspace_seen") if key in st.session_state}
+    st.session_state.clear()
+    st.session_state.update(kept)
+
+def reset_analysis_state():
+    # 워크스페이스 모드 전환이나 분석 대상 변경 시 위젯 상태는 그대로 두고 분석 결과만 초기화
+    for key in ("vector_db", "doc_fingerprint", "doc_ids", "project_summary", "stage_contexts", "structured_stages",
+                "uploaded_filename", "raw_text", "refined_text", "source_file_type"):
+        st.session_state.pop(key, None)
+    st.session_state.stage = 0
+    st.session_state.reports = {}
+    st.session_state.report_history = {}
+
+def prepare_analysis(vector_db, doc_fingerprint, doc_ids=None):
+    st.session_state.vector_db = vector_db
+    st.session_state.doc_fingerprint = doc_fingerprint
+    st.session_state.doc_ids = doc_ids
+    if vector_db:
+        # 사업 개요와 단계별 검색을 미리 동시에 수행하여, 단계 버튼은 최종 생성 호출만 하도록 함
+        with st.spinner("사업 개요 추출 및 단계별 관련 내용 검색을 동시에 진행 중입니다..."):
+            (st.session_state.project_summary, st.session_state.stage_contexts,
+             st.session_state.structured_stages) = run_upload_pipeline(vector_db, doc_fingerprint, doc_ids=doc_ids)
+    st.session_state.stage = 0
+
+# 분석 보고서가 생성되는 동안 토큰을 실시간으로 보여줄 메인 화면 영역
+stream_area = st.empty()
 
 # --- 사이드바 ---
 with st.sidebar:
     st.header("1. 문서 업로드")
-    uploaded_file = st.file_uploader("PDF/TXT 파일", type=["pdf", "txt"], help="새로운 파일을 올리면 모든 분석이 초기화됩니다.")
-
-    if uploaded_file and st.session_state.get("uploaded_filename") != uploaded_file.name:
-        st.session_state.clear()
-        st.session_state.uploaded_filename = uploaded_file.name
-        
-        raw_text, refined_text = extract_text_from_file(uploaded_file)
-        
-        if refined_text:
-            st.session_state.raw_text = raw_text
-            st.session_state.refined_text = refined_text
-            st.session_state.source_file_type = uploaded_file.type
+    workspace_mode = st.toggle(
+        "📚 워크스페이스 모드", key="workspace_mode", on_change=reset_analysis_state,
+        help="RFP와 변경 공고, 질의응답, 첨부 문서를 함께 올려 하나의 인덱스로 분석합니다."
+    )
+
+    if not workspace_mode:
+        uploaded_file = st.file_uploader("PDF/TXT 파일", type=["pdf", "txt"], help="새로운 파일을 올리면 모든 분석이 초기화됩니다.")
+
+        if uploaded_file and st.session_state.get("uploaded_filename") != uploaded_file.name:
+            reset_session_state()
+            st.session_state.uploaded_filename = uploaded_file.name
             
-            st.session_state.vector_db = create_vector_db(st.session_state.refined_text)
-            st.session_state.project_summary = extract_project_summary(st.session_state.vector_db)
+            raw_text, refined_text = extract_text_from_file(uploaded_file)
+            
+            if refined_text:
+                st.session_state.raw_text = raw_text
+                st.session_state.refined_text = refined_text
+                st.session_state.source_file_type = uploaded_file.type
+                fingerprint = document_fingerprint(refined_text)
+                prepare_analysis(create_vector_db(refined_text), fingerprint)
             st.session_state.stage = 0
-        st.rerun()
+            st.rerun()
+    else:
+        # 문서를 올리거나 지워도 인덱스를 다시 만들지 않고 해당 문서의 chunk만 추가/삭제
+        workspace = st.session_state.setdefault("workspace", Workspace())
+        seen = st.session_state.setdefault("workspace_seen", set())
+        uploaded_files = st.file_uploader(
+            "PDF/TXT 파일 (여러 개)", type=["pdf", "txt"], accept_multiple_files=True,
+            help="올린 문서는 기존 문서를 유지한 채 워크스페이스에 추가됩니다."
+        )
+        new_files = [f for f in uploaded_files or [] if f.file_id not in seen]
+        for new_file in new_files:
+            seen.add(new_file.file_id)
+            add_to_workspace(workspace, new_file)
+        if new_files:
+            st.session_state.pop("workspace_selection", None)
+            st.rerun()
+
+        for doc_id, entry in list(workspace.documents.items()):
+            name_col, remove_col = st.columns([5, 1])
+            name_col.caption(f"📄 {entry['name']}" + (f" ({entry['pages']}쪽)" if entry["pages"] else ""))
+            if remove_col.button("🗑", key=f"remove_{doc_id}", help="워크스페이스에서 제거"):
+                workspace.remove_document(doc_id)
+                st.session_state.pop("workspace_selection", None)
+                st.rerun()
+
+        selected_ids = []
+        if workspace.documents:
+            selected_ids = st.multiselect(
+                "분석 대상 문서", options=workspace.doc_ids(), default=workspace.doc_ids(),
+                format_func=lambda doc_id: workspace.documents[doc_id]["name"], key="workspace_selection"
+            )
+        # 문서 구성이나 분석 대상이 바뀌면 새 조합으로 사업 개요/단계별 검색을 다시 수행
+        fingerprint = workspace_fingerprint(selected_ids) if selected_ids else None
+        if fingerprint != st.session_state.get("doc_fingerprint"):
+            reset_analysis_state()
+            if fingerprint:
+                prepare_analysis(workspace.vector_db, fingerprint, selected_ids)
+            st.rerun()
+
+    # batch.py로 미리 분석해 둔 문서는 업로드/정제/생성 없이 저장된 인덱스와 보고서를 바로 불러옴
+    batch_results = list_batch_results()
+    if batch_results:
+        with st.expander("📂 미리 분석된 문서 열기"):
+            selected = st.selectbox("배치 분석 결과", batch_results, label_visibility="collapsed")
+            if workspace_mode and st.button("워크스페이스에 추가", use_container_width=True):
+                # 배치에서 임베딩한 chunk는 임베딩 캐시에 있으므로 API 호출 없이 추가됨
+                result = load_batch_result(selected)
+                if add_text_to_workspace(workspace, result["file_name"], result["refined_text"]):
+                    st.session_state.pop("workspace_selection", None)
+                    st.rerun()
+            if not workspace_mode and st.button("열기", use_container_width=True):
+                result = load_batch_result(selected)
+                reset_session_state()
+                st.session_state.uploaded_filename = result["file_name"]
+                st.session_state.raw_text = result["raw_text"]
+                st.session_state.refined_text = result["refined_text"]
+                st.session_state.source_file_type = result["file_type"]
+                st.session_state.doc_fingerprint = result["doc_fingerprint"]
+                st.session_state.vector_db = load_vector_db(result["doc_fingerprint"])
+                st.session_state.project_summary = result["project_summary"]
+                st.session_state.reports = result["reports"]
+                st.session_state.stage = len(result["reports"])
+                st.session_state.active_tab_key = 'risk'
+                st.rerun()
 
     if st.session_state.get("source_file_type") == "application/pdf" and st.session_state.get("raw_text"):
         st.download_button(
@@ -51,31 +169,98 @@ with st.sidebar:
         with st.expander("사업 핵심 개요", expanded=True):
             st.markdown(st.session_state.project_summary)
 
+    if st.session_state.get("doc_fingerprint"):
+        cache_stats = get_result_cache().stats()
+        st.caption(f"분석 결과 캐시: 적중 {cache_stats['hits']}회 / 미스 {cache_stats['misses']}회")
+        if st.button("🔄 이 문서의 분석 결과 캐시 삭제", help="저장된 분석 결과를 지우고 다음 실행 시 새로 생성합니다."):
+            invalidate_cached_results(st.session_state.doc_fingerprint)
+            st.toast("이 문서의 분석 결과 캐시를 삭제했습니다.")
+
     st.header("2. 분석 단계 실행")
     if st.session_state.get("vector_db"):
+        with st.expander("⚙️ 검색 설정"):
+            st.caption("HyDE(가상 답변 생성)를 끄면 벡터+키워드 하이브리드 검색만 사용하여 단계별 LLM 호출 1회를 줄입니다. "
+                       "문서 구조에서 해당 절을 찾은 단계는 검색 없이 절 원문을 사용하므로 HyDE 설정이 적용되지 않습니다.")
+            # 업로드 시 단계별 context를 준비하면서 문서 구조에서 꺼낸 단계 (화면을 다시 그릴 때마다 조회하지 않음)
+            structured = st.session_state.get("structured_stages", ())
+            for stage, label in {"risk": "단계 1", "ksf": "단계 2", "outline": "단계 3"}.items():
+                st.toggle(
+                    f"{label} HyDE 사용", value=STAGE_QUERIES[stage]["use_hyde"], key=f"use_hyde_{stage}",
+                    disabled=stage in structured,
+                    help="문서 구조에서 찾은 절을 context로 사용하므로 HyDE/검색을 하지 않습니다." if stage in structured else None
+                )
+
         if st.button("단계 1: 리스크 분석", disabled=(st.session_state.stage >= 1), type="primary"):
-            st.session_state.reports['risk'] = generate_risk_report(st.session_state.vector_db)
+            with stream_area.container():
+                st.subheader("📊 리스크 분석 생성 중...")
+                st.session_state.reports['risk'] = st.write_stream(
+                    generate_risk_report(
+                        st.session_state.vector_db, st.session_state.doc_fingerprint, stream=True,
+                        **stage_options('risk')
+                    )
+                )
             st.session_state.stage = 1
             st.session_state.active_tab_key = 'risk'
             st.rerun()
 
         if st.button("단계 2: 핵심 성공 요소 분석", disabled=(st.session_state.stage < 1 or st.session_state.stage >= 2), type="primary"):
-            st.session_state.reports['ksf'] = generate_ksf_report(st.session_state.vector_db, st.session_state.reports['risk'])
+            with stream_area.container():
+                st.subheader("🔑 KSF 분석 생성 중...")
+                st.session_state.reports['ksf'] = st.write_stream(generate_ksf_report(
+                    st.session_state.vector_db, st.session_state.doc_fingerprint, st.session_state.reports['risk'],
+                    stream=True, **stage_options('ksf')
+                ))
             st.session_state.stage = 2
             st.session_state.active_tab_key = 'ksf'
             st.rerun()
 
         if st.button("단계 3: 제안 목차 생성", disabled=(st.session_state.stage < 2 or st.session_state.stage >= 3), type="primary"):
-            st.session_state.reports['outline'] = generate_outline_report(
-                st.session_state.vector_db,
-                st.session_state.project_summary,
-                st.session_state.reports['risk'],
-                st.session_state.reports['ksf']
-            )
+            with stream_area.container():
+                st.subheader("📑 제안 목차 생성 중...")
+                st.session_state.reports['outline'] = st.write_stream(generate_outline_report(
+                    st.session_state.vector_db,
+                    st.session_state.doc_fingerprint,
+                    st.session_state.project_summary,
+                    st.session_state.reports['risk'],
+                    st.session_state.reports['ksf'],
+                    stream=True,
+                    **stage_options('outline')
+                ))
             st.session_state.stage = 3
             st.session_state.active_tab_key = 'outline'
             st.rerun()
 
+    records = session_records(st.session_state.session_id)
+    if records:
+        with st.expander("📈 성능/비용 지표"):
+            total_seconds = sum(r["seconds"] for r in records)
+            total_tokens = sum(r["prompt_tokens"] + r["completion_tokens"] + r["embedding_tokens"] for r in records)
+            total_cost = sum(r["cost_usd"] for r in records)
+            hits = sum(r["cache_hits"] for r in records)
+            lookups = hits + sum(r["cache_misses"] for r in records)
+            st.caption(
+                f"총 {total_seconds:.1f}초 · 토큰 {total_tokens:,}개 · 예상 비용 ${total_cost:.4f}"
+                + (f" · 캐시 적중률 {hits / lookups:.0%}" if lookups else "")
+            )
+            st.dataframe(
+                [
+                    {
+                        "단계": r["stage"],
+                        "소요(초)": r["seconds"],
+                        "세부 구간": ", ".join(f"{k} {v:.2f}s" for k, v in r["steps"].items()),
+                        "LLM 호출": r["llm_calls"],
+                        "입력 토큰": r["prompt_tokens"],
+                        "출력 토큰": r["completion_tokens"],
+                        "임베딩 토큰": r["embedding_tokens"],
+                        "비용($)": r["cost_usd"],
+                        "캐시 적중/미스": f"{r['cache_hits']}/{r['cache_misses']}",
+                        "재시도/병합": f"{r['llm_retries']}/{r['llm_coalesced']}",
+                    }
+                    for r in reversed(records)
+                ],
+                hide_index=True,
+            )
+
 # --- 메인 화면 ---
 if st.session_state.stage == 0:
     st.info("⬅️ 왼쪽 사이드바에서 문서를 업로드하고 분석 단계를 시작해주세요.")
@@ -110,16 +295,39 @@ else:
         if available_keys:
             active_key = st.session_state.active_tab_key
             # [수정됨] 안내 메시지 변경
-            st.info(f"현재 **'{report_options[active_key]}'** 보고서 **전체**를 대상으로 수정합니다.")
+            st.info(
+                f"현재 **'{report_options[active_key]}'** 보고서를 대상으로 수정합니다. "
+                "요청에 항목 번호(예: '2번 항목')나 항목 제목을 포함하면 해당 항목만 빠르게 수정하고, "
+                "그렇지 않으면 보고서 **전체**를 수정합니다."
+            )
+
+            # 이전 버전은 변경된 줄만 담은 패치로 보관
+            history = st.session_state.report_history.setdefault(active_key, [])
+            if history and st.button(f"↩️ 이전 버전으로 되돌리기 ({len(history)}개 보관)"):
+                st.session_state.reports[active_key] = apply_report_patch(
+                    st.session_state.reports[active_key], history.pop()
+                )
+                st.rerun()
             
             if prompt := st.chat_input("수정 요청 사항을 입력하세요..."):
                 original_report = st.session_state.reports.get(active_key, "")
                 
-                # [수정됨] 잠금/해제 로직 제거, 보고서 전체를 수정하도록 변경
-                with st.spinner("보고서 전체를 수정 중입니다..."):
-                    new_full_report = refine_report_with_chat(
-                        st.session_state.vector_db, original_report, prompt
-                    )
+                with st.chat_message("assistant"):
+                    with st.spinner("요청한 항목을 수정 중입니다..."):
+                        item_result = refine_report_items_with_chat(
+                            st.session_state.vector_db, original_report, prompt, doc_ids=st.session_state.get("doc_ids")
+                        )
+                    if item_result:
+                        new_full_report = item_result[0]
+                    else:
+                        # [수정됨] 잠금/해제 로직 제거, 대상 항목이 없으면 보고서 전체를 수정
+                        with st.spinner("보고서 전체를 수정 중입니다..."):
+                            report_stream = refine_report_with_chat(
+                                st.session_state.vector_db, original_report, prompt, stream=True,
+                                doc_ids=st.session_state.get("doc_ids")
+                            )
+                        new_full_report = st.write_stream(report_stream)
+                    history.append(make_report_patch(new_full_report, original_report))
                     st.session_state.reports[active_key] = new_full_report
                     st.success(f"'{report_options[active_key]}' 보고서를 수정했습니다.")
                     st.rerun()
@@ -0,0 +1,970 @@
+# pipeline.py
+"""Streamlit과 무관한 RFP 분석 파이프라인 (추출 → 정제 → 인덱싱 → 사업 개요 → 리스크 → KSF → 목차).
+
+화면 표시가 필요한 곳은 status(스피너 등 컨텍스트 매니저)와 on_progress 콜백으로 주입받고,
+오류는 예외로 올려 보내 호출하는 쪽(utils.py의 Streamlit 래퍼, batch.py)에서 처리한다.
+"""
+import os
+import re
+import time
+import shutil
+import logging
+import difflib
+import subprocess
+import itertools
+import multiprocessing
+from bisect import bisect_right
+from collections import deque
+from contextlib import nullcontext
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import fitz
+import httpx
+import openai
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.prompts import PromptTemplate
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_community.vectorstores import FAISS
+from cache import EmbeddingCache, CachedEmbeddings, ResultCache, OcrCache, content_hash
+from index_store import IndexStore, document_fingerprint
+from retrieval import (
+    get_lexical_index, hybrid_search, pack_context, pack_sections, count_tokens, truncate_to_tokens, get_encoding
+)
+from rfp_structure import RfpStructure, STRUCTURE_VERSION, find_requirement_ids
+from instrumentation import metrics_handler, track_stage, track_step, record_cache, annotate, submit_with_context
+from llm_gateway import LLMGateway
+from prompts import (
+    PROJECT_SUMMARY_PROMPT, RISK_ANALYSIS_PROMPT, KSF_ANALYSIS_PROMPT,
+    HOLISTIC_PRESENTATION_STORYLINE_PROMPT, HYDE_PROMPT,
+    TEXT_REFINEMENT_PROMPT, GENERAL_REPORT_REFINEMENT_PROMPT,
+    ITEM_REFINEMENT_PROMPT, PROMPT_TOKEN_BUDGETS
+)
+
+logger = logging.getLogger(__name__)
+
+API_KEY = os.getenv("OPENAI_API_KEY")
+
+LLM_MODEL = "gpt-4o"
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL")  # OpenAI 호환 서버(프록시, 로컬 대역 서버 등)를 쓸 때 지정
+ANALYSIS_TEMPERATURE = 0.3
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# 프로세스 안의 모든 세션이 함께 지키는 LLM 요청 상한 (배치 실행 시 프로세스 수에 맞춰 나누어 가짐)
+LLM_MAX_CONCURRENCY = int(os.getenv("RFP_LLM_CONCURRENCY", 8))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("RFP_LLM_TPM", 30000))  # 0이면 제한하지 않음
+LLM_MAX_RETRIES = int(os.getenv("RFP_LLM_MAX_RETRIES", 5))
+LLM_REQUEST_TIMEOUT = 120
+LLM_EXPECTED_OUTPUT_TOKENS = 1500  # TPM 차감 시 응답 토큰 추정치 (실제 사용량은 응답 후에야 알 수 있음)
+
+# PDF 페이지 병렬 추출 설정
+PDF_PAGES_PER_TASK = 16
+PDF_PARALLEL_MIN_PAGES = 48  # 이보다 짧은 문서는 프로세스 풀 기동 비용이 더 큼
+PDF_MAX_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+
+# 스캔 페이지 OCR 설정 (packages.txt의 tesseract-ocr, tesseract-ocr-kor 사용)
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", "tesseract")
+OCR_LANGUAGES = "kor+eng"
+OCR_DPI = 300
+OCR_TIMEOUT = 180
+OCR_MAX_WORKERS = PDF_MAX_WORKERS
+OCR_MIN_TEXT_CHARS = 20  # 공백을 뺀 텍스트 레이어가 이보다 짧으면 스캔 페이지로 간주
+OCR_MAX_GARBLED_RATIO = 0.3  # 글꼴 인코딩이 깨져 대체 문자/사용자 정의 영역 문자가 이 비율을 넘으면 OCR
+GARBLED_PATTERN = re.compile(r"[\ufffd\ue000-\uf8ff\x00-\x08\x0b-\x1f\x7f-\x9f]")
+
+# OCR 텍스트 정제 구간(window) 설정
+REFINE_WINDOW_TOKENS = 3000  # 출력도 입력과 비슷한 길이이므로 모델 출력 한도보다 충분히 작게 유지
+REFINE_MAX_WORKERS = 4
+
+# 벡터 DB chunk 설정
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+CHUNK_METADATA_VERSION = 2  # chunk 메타데이터(start_index, doc_id, page 등) 형식이 바뀌면 올려서 저장된 인덱스를 다시 만듦
+
+# 문서 구조(절 트리, 요구사항 ID 표) 기반 context 설정
+STRUCTURE_MIN_CONTEXT_RATIO = 0.2  # 구조에서 찾은 절이 context 예산의 이 비율보다 적으면 검색으로 대신함
+MAX_REQUIREMENT_LOOKUPS = 5  # 보고서 수정 요청에서 요구사항 표로 바로 찾을 ID 수
+
+llm_gateway = LLMGateway(LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES)
+
+
+def set_api_key(api_key):
+    global API_KEY
+    API_KEY = api_key
+
+
+def set_llm_concurrency(limit):
+    llm_gateway.configure(max_concurrency=limit)
+
+
+def set_llm_rate_limit(tokens_per_minute):
+    llm_gateway.configure(tokens_per_minute=tokens_per_minute)
+
+
+@lru_cache(maxsize=None)
+def get_http_client():
+    # 모든 ChatOpenAI가 하나의 연결 풀을 공유하여 요청마다 TCP/TLS 연결을 새로 맺지 않도록 함
+    # (동시 요청 수는 게이트웨이가 제한하므로 풀에서는 유지할 연결 수만 정함)
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=LLM_MAX_CONCURRENCY)
+    )
+
+
+@lru_cache(maxsize=None)
+def _cached_chat_llm(api_key, base_url, temperature):
+    # 재시도는 게이트웨이가 429/Retry-After를 보고 처리하므로 클라이언트 자체 재시도는 끔
+    return ChatOpenAI(
+        model=LLM_MODEL, temperature=temperature, openai_api_key=api_key, base_url=base_url,
+        max_retries=0, request_timeout=LLM_REQUEST_TIMEOUT, http_client=get_http_client(),
+        callbacks=[metrics_handler], stream_usage=True
+    )
+
+
+def _chat_llm(temperature):
+    # 모든 LLM 호출의 소요 시간/토큰/비용이 현재 단계 기록에 모이도록 콜백을 연결한 클라이언트를 재사용
+    return _cached_chat_llm(API_KEY, LLM_BASE_URL, temperature)
+
+
+def _request_profile(chain, inputs):
+    # TPM 차감량(프롬프트 + 응답 추정 토큰)과, 진행 중인 같은 요청을 찾기 위한 키(프롬프트 + 모델 설정 + 출력 형식)
+    prompt_text = chain.first.format(**inputs)
+    llm = chain.steps[1]
+    key = content_hash(LLM_MODEL, llm.temperature, type(chain.last).__name__, prompt_text)
+    return count_tokens(prompt_text) + LLM_EXPECTED_OUTPUT_TOKENS, key
+
+
+def _invoke(chain, inputs, step):
+    tokens, key = _request_profile(chain, inputs)
+    return llm_gateway.invoke(lambda: chain.invoke(inputs, config={"tags": [step]}), tokens, key)
+
+
+def _stream(chain, inputs, step):
+    # 스트림을 끝까지 받을 때까지 동시 요청 한 자리를 차지 (같은 스트림을 여러 세션이 함께 받아도 한 자리)
+    tokens, key = _request_profile(chain, inputs)
+    yield from llm_gateway.stream(lambda: chain.stream(inputs, config={"tags": [step]}), tokens, key)
+
+
+# --- 공용 저장소 (프로세스당 하나) ---
+
+@lru_cache(maxsize=None)
+def get_embedding_cache():
+    return EmbeddingCache()
+
+
+@lru_cache(maxsize=None)
+def get_index_store():
+    # 인덱스 내용을 바꾸는 설정을 저장 키에 넣어, 설정이 바뀌면 이전 인덱스 대신 새로 만듦
+    return IndexStore(settings=(CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_METADATA_VERSION, EMBEDDING_MODEL))
+
+
+@lru_cache(maxsize=None)
+def get_result_cache():
+    return ResultCache()
+
+
+def get_embeddings():
+    # 동일한 chunk는 디스크 캐시에서 재사용하고 새로운 chunk만 임베딩
+    return CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=API_KEY), get_embedding_cache())
+
+
+# --- 텍스트 추출 및 정제 ---
+
+def _split_oversized(paragraph, max_tokens):
+    # 구간 한도를 넘는 문단은 줄 단위로, 한 줄도 넘으면 토큰 단위로 자름
+    encoding = get_encoding()
+    pieces, current, current_tokens = [], [], 0
+    for line in paragraph.split("\n"):
+        tokens = encoding.encode(line)
+        parts = [line] if len(tokens) <= max_tokens else [
+            encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)
+        ]
+        for part in parts:
+            part_tokens = count_tokens(part)
+            if current and current_tokens + part_tokens > max_tokens:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def split_pages_into_windows(pages, max_tokens=REFINE_WINDOW_TOKENS):
+    """[(페이지 번호, 텍스트)]를 페이지/문단 경계("\n\n")를 유지하면서 토큰 한도 이내의 구간으로 나눔.
+
+    구간마다 (첫 페이지, 마지막 페이지, 텍스트)를 반환하여 정제 후에도 chunk의 페이지 범위를 알 수 있도록 한다.
+    """
+    windows, current, current_tokens, first_page, last_page = [], [], 0, None, None
+    for page_no, page_text in pages:
+        for paragraph in page_text.split("\n\n"):
+            if not paragraph.strip():
+                continue
+            paragraph_tokens = count_tokens(paragraph)
+            units = [paragraph] if paragraph_tokens <= max_tokens else _split_oversized(paragraph, max_tokens)
+            for unit in units:
+                unit_tokens = paragraph_tokens if len(units) == 1 else count_tokens(unit)
+                if current and current_tokens + unit_tokens > max_tokens:
+                    windows.append((first_page, last_page, "\n\n".join(current)))
+                    current, current_tokens = [], 0
+                if not current:
+                    first_page = page_no
+                last_page = page_no
+                current.append(unit)
+                current_tokens += unit_tokens
+    if current:
+        windows.append((first_page, last_page, "\n\n".join(current)))
+    return windows
+
+
+def split_text_into_windows(text, max_tokens=REFINE_WINDOW_TOKENS):
+    """페이지/문단 경계("\n\n")를 유지하면서 토큰 한도 이내의 구간으로 텍스트를 나눔."""
+    return [window for _, _, window in split_pages_into_windows([(None, text)], max_tokens)]
+
+
+def _refine_window(window_text):
+    # 구간별 정제 결과를 디스크에 보관하여, 배치로 미리 분석했거나 다시 올린 문서는 LLM 호출 없이 재사용
+    result_cache = get_result_cache()
+    window_fingerprint = content_hash("refine", window_text)
+    key = ResultCache.make_key(window_fingerprint, "refine", [TEXT_REFINEMENT_PROMPT], LLM_MODEL, 0)
+    refined = result_cache.get(key)
+    record_cache(refined is not None)
+    if refined is None:
+        prompt = PromptTemplate.from_template(TEXT_REFINEMENT_PROMPT)
+        chain = prompt | _chat_llm(0) | StrOutputParser()
+        refined = _invoke(chain, {"raw_text": window_text}, "refine").strip()
+        result_cache.put(key, window_fingerprint, "refine", refined)
+    return refined
+
+
+def refine_pages(pages, on_progress=None):
+    """페이지 텍스트를 구간별로 동시에 정제하여 ([(첫 페이지, 마지막 페이지, 정제 텍스트)], [(실패 구간 번호, 예외)])를 반환.
+
+    실패한 구간은 원본 텍스트를 사용한다.
+    """
+    windows = split_pages_into_windows(pages)
+    refined_windows = [None] * len(windows)
+    failed = []
+    with track_stage("refine", windows=len(windows)), ThreadPoolExecutor(max_workers=REFINE_MAX_WORKERS) as executor:
+        futures = {submit_with_context(executor, _refine_window, window[2]): i for i, window in enumerate(windows)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            first_page, last_page, window_text = windows[i]
+            try:
+                refined_windows[i] = (first_page, last_page, future.result())
+            except Exception as e:
+                refined_windows[i] = windows[i]
+                failed.append((i + 1, e))
+            if on_progress:
+                on_progress(done, len(windows))
+        annotate(failed_windows=len(failed))
+    return refined_windows, failed
+
+
+def refine_text(text_to_refine, on_progress=None):
+    """OCR 텍스트를 구간별로 동시에 정제하여 (정제 텍스트, [(실패 구간 번호, 예외)])를 반환. 실패한 구간은 원본을 사용."""
+    if not text_to_refine or not text_to_refine.strip():
+        return "", []
+    segments, failed = refine_pages([(None, text_to_refine)], on_progress)
+    return join_segments(segments), failed
+
+
+def join_segments(segments):
+    return "\n\n".join(text for _, _, text in segments)
+
+
+def _clean_page_text(text):
+    return re.sub(r'\n\s*\n', '\n\n', text).strip()
+
+
+def _needs_ocr(page, text):
+    compact = re.sub(r"\s+", "", text)
+    # 글꼴 인코딩이 깨진 페이지는 대개 이미지 없이 벡터 글자만 있으므로 이미지 여부와 관계없이 OCR
+    if compact and len(GARBLED_PATTERN.findall(compact)) / len(compact) > OCR_MAX_GARBLED_RATIO:
+        return True
+    if len(compact) >= OCR_MIN_TEXT_CHARS:
+        return False
+    # 텍스트가 (거의) 없는 페이지는 이미지가 있을 때만 스캔 페이지로 봄 (빈 페이지는 OCR해도 얻을 것이 없음)
+    return bool(page.get_images())
+
+
+def _extract_pages(doc, start, end):
+    pages = []
+    for page_no in range(start, end):
+        page = doc[page_no]
+        blocks = page.get_text("blocks", sort=True)
+        text = _clean_page_text("\n".join([b[4] for b in blocks if b[4].strip()]))
+        pages.append((page_no + 1, text, _needs_ocr(page, text)))
+    return pages
+
+
+@lru_cache(maxsize=None)
+def _process_context():
+    # Streamlit 서버는 여러 스레드(Tornado, 게이트웨이 스트림)와 SQLite 연결/락을 가지므로, 다른 스레드가 잡은 락을
+    # 물려받지 않도록 fork 대신 깨끗한 프로세스에서 워커를 시작 (batch.py와 같은 이유)
+    # forkserver는 이 모듈을 미리 import한 서버 프로세스를 한 번만 띄워 재사용하므로 풀을 만들 때마다 import하지 않음
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+# 워커 프로세스마다 PDF를 한 번만 열어두고 페이지 범위 작업에 재사용
+_worker_doc = None
+
+
+def _init_pdf_worker(file_bytes):
+    global _worker_doc
+    _worker_doc = fitz.open(stream=file_bytes, filetype="pdf")
+
+
+def _extract_page_range(start, end):
+    return _extract_pages(_worker_doc, start, end)
+
+
+def iter_pdf_pages(file_bytes, max_workers=PDF_MAX_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """PDF 페이지 텍스트를 페이지 순서대로 Document(metadata={"page": n, "needs_ocr": bool})로 내보내는 제너레이터.
+
+    needs_ocr는 텍스트 레이어가 없고 이미지가 있는 (스캔) 페이지, 또는 텍스트 레이어가 깨진 페이지를 뜻한다.
+    """
+    doc = fitz.open(stream=file_bytes, filetype="pdf")
+    page_count = doc.page_count
+    if page_count < PDF_PARALLEL_MIN_PAGES or max_workers <= 1:
+        try:
+            for start in range(0, page_count, pages_per_task):
+                for page_no, text, needs_ocr in _extract_pages(doc, start, min(start + pages_per_task, page_count)):
+                    yield Document(page_content=text, metadata={"page": page_no, "needs_ocr": needs_ocr})
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    ranges = ((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=_process_context(), initializer=_init_pdf_worker, initargs=(file_bytes,)
+    ) as executor:
+        # 진행 중인 작업 수를 제한하여 결과가 메모리에 쌓이지 않도록 함
+        pending = deque(executor.submit(_extract_page_range, *r) for r in itertools.islice(ranges, max_workers * 2))
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(executor.submit(_extract_page_range, *next_range))
+            for page_no, text, needs_ocr in pages:
+                yield Document(page_content=text, metadata={"page": page_no, "needs_ocr": needs_ocr})
+
+
+# OCR 워커 프로세스마다 PDF와 OCR 캐시 연결을 한 번만 열어둠
+_worker_ocr_cache = None
+
+
+def _init_ocr_worker(file_bytes):
+    global _worker_ocr_cache
+    _init_pdf_worker(file_bytes)
+    _worker_ocr_cache = OcrCache()
+
+
+def run_tesseract(image_bytes, languages=OCR_LANGUAGES):
+    # 페이지 단위로 프로세스를 나누었으므로 tesseract 내부 스레드는 1개로 제한
+    result = subprocess.run(
+        [TESSERACT_CMD, "stdin", "stdout", "-l", languages, "--psm", "3"],
+        input=image_bytes, capture_output=True, timeout=OCR_TIMEOUT, check=True,
+        env={**os.environ, "OMP_THREAD_LIMIT": "1"},
+    )
+    return _clean_page_text(result.stdout.decode("utf-8", errors="replace"))
+
+
+def _ocr_page(page_no):
+    pixmap = _worker_doc[page_no - 1].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+    image_bytes = pixmap.tobytes("png")
+    key = OcrCache.make_key(image_bytes, OCR_LANGUAGES)
+    text = _worker_ocr_cache.get(key)
+    if text is not None:
+        return text, True
+    text = run_tesseract(image_bytes)
+    _worker_ocr_cache.put(key, text)
+    return text, False
+
+
+def ocr_available():
+    return shutil.which(TESSERACT_CMD) is not None
+
+
+def ocr_pdf_pages(file_bytes, page_numbers, max_workers=OCR_MAX_WORKERS):
+    """지정한 페이지만 래스터화하여 Tesseract로 OCR한 {페이지 번호: 텍스트}를 반환. 실패한 페이지는 빠짐."""
+    if not page_numbers:
+        return {}
+    if not ocr_available():
+        logger.warning("tesseract를 찾을 수 없어 스캔 페이지 %d쪽의 OCR을 건너뜁니다.", len(page_numbers))
+        return {}
+    results, failed = {}, []
+    with track_stage("ocr", pages=len(page_numbers)):
+        workers = max(1, min(max_workers, len(page_numbers)))
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=_process_context(), initializer=_init_ocr_worker, initargs=(file_bytes,)
+        ) as executor:
+            futures = {executor.submit(_ocr_page, page_no): page_no for page_no in page_numbers}
+            for future in as_completed(futures):
+                try:
+                    text, cached = future.result()
+                except Exception as e:
+                    failed.append((futures[future], e))
+                    continue
+                record_cache(cached)
+                results[futures[future]] = text
+        annotate(ocr_failed=len(failed))
+    if failed:
+        logger.warning("%d개 페이지 OCR 실패 (%s): %s", len(failed), ", ".join(str(n) for n, _ in sorted(failed)), failed[0][1])
+    return results
+
+
+def extract_pages(file_bytes, file_type, pdf_workers=PDF_MAX_WORKERS, ocr=True):
+    """[(페이지 번호, 텍스트)]를 반환. 텍스트 파일은 페이지 번호 없이 한 덩어리로 반환.
+
+    PDF는 텍스트 레이어가 없는 스캔 페이지만 골라 OCR하므로, 일반 문서에는 OCR 비용이 들지 않는다.
+    """
+    if file_type == "application/pdf":
+        pages, scanned = [], []
+        for page in iter_pdf_pages(file_bytes, max_workers=pdf_workers):
+            pages.append((page.metadata["page"], page.page_content))
+            if page.metadata["needs_ocr"]:
+                scanned.append(page.metadata["page"])
+        if ocr and scanned:
+            ocr_texts = ocr_pdf_pages(file_bytes, scanned, max_workers=max(1, pdf_workers))
+            pages = [(page_no, ocr_texts.get(page_no) or text) for page_no, text in pages]
+        return [(page_no, text) for page_no, text in pages if text]
+    if file_type == "text/plain":
+        return [(None, file_bytes.decode("utf-8"))]
+    raise ValueError(f"지원하지 않는 파일 형식입니다: {file_type}")
+
+
+def extract_raw_text(file_bytes, file_type, pdf_workers=PDF_MAX_WORKERS):
+    return "\n\n".join(text for _, text in extract_pages(file_bytes, file_type, pdf_workers))
+
+
+# --- 인덱싱 ---
+
+def split_text_into_chunks(refined_text, metadata=None, segments=None):
+    """정제 텍스트를 chunk로 나눔. segments(join_segments(segments) == refined_text)를 주면 chunk마다 페이지 범위를 붙임."""
+    # start_index를 남겨 두면 context 구성 시 겹치는 chunk를 위치 기준으로 병합할 수 있음
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    chunks = text_splitter.create_documents([refined_text], metadatas=[metadata or {}])
+    if segments:
+        offsets, position = [], 0
+        for _, _, text in segments:
+            offsets.append(position)
+            position += len(text) + 2  # 구간 사이의 "\n\n"
+        for chunk in chunks:
+            first_page, last_page, _ = segments[bisect_right(offsets, chunk.metadata["start_index"]) - 1]
+            if first_page is not None:
+                chunk.metadata["page"] = first_page
+                chunk.metadata["page_end"] = last_page
+    return chunks
+
+
+def attach_structure(vector_db, doc_id, structure):
+    # 문서 구조를 FAISS 인덱스에 붙여서 보관 (워크스페이스는 문서마다 하나씩)
+    if getattr(vector_db, "_rfp_structures", None) is None:
+        vector_db._rfp_structures = {}
+    structure.doc_id = doc_id
+    vector_db._rfp_structures[doc_id] = structure
+
+
+def detach_structure(vector_db, doc_id):
+    getattr(vector_db, "_rfp_structures", {}).pop(doc_id, None)
+
+
+def get_structures(vector_db, doc_ids=None):
+    structures = getattr(vector_db, "_rfp_structures", None) or {}
+    if doc_ids is None:
+        return list(structures.values())
+    return [structures[doc_id] for doc_id in doc_ids if doc_id in structures]
+
+
+def _load_structure(doc_fingerprint, refined_text=None):
+    # 인덱스와 함께 저장한 구조를 읽고, 없으면(구조 색인 이전에 만든 인덱스 등) 원문이 있을 때 한 번 파싱하여 저장
+    index_store = get_index_store()
+    structure = RfpStructure.from_dict(index_store.get_structure(doc_fingerprint))
+    if structure is None and refined_text:
+        structure = RfpStructure.parse(refined_text)
+        index_store.put_structure(doc_fingerprint, structure.to_dict())
+    return structure
+
+
+def create_vector_db(refined_text, status=nullcontext):
+    if not refined_text:
+        return None
+    with track_stage("index"):
+        # 같은 문서의 인덱스가 이미 있으면(다른 세션/서버 재시작 이전/배치 분석 포함) 재임베딩 없이 바로 사용
+        index_store = get_index_store()
+        fingerprint = document_fingerprint(refined_text)
+        embeddings = get_embeddings()
+        with track_step("index_load"):
+            vector_db = index_store.get(fingerprint, embeddings)
+        record_cache(vector_db is not None)
+        if vector_db is None:
+            with status("문서를 분석하여 AI가 이해할 수 있도록 준비 중입니다..."):
+                with track_step("chunking"):
+                    # 워크스페이스 chunk와 같이 doc_id를 붙여, 요구사항 원문과 겹치는 chunk를 같은 문서로 보고 합침
+                    doc_chunks = split_text_into_chunks(refined_text, metadata={"doc_id": fingerprint})
+                vector_db = FAISS.from_documents(doc_chunks, embeddings)
+                with track_step("index_save"):
+                    vector_db = index_store.put(fingerprint, vector_db)
+        # 요구사항 ID, 금액 등 정확한 용어 검색을 위한 BM25 인덱스를 함께 준비
+        with track_step("lexical_index"):
+            get_lexical_index(vector_db)
+        # 절 트리와 요구사항 ID 표도 인덱싱 시 한 번 만들어 두어, 사업 개요와 단계별 context를 검색 없이 바로 꺼냄
+        if not get_structures(vector_db):
+            with track_step("structure"):
+                attach_structure(vector_db, fingerprint, _load_structure(fingerprint, refined_text))
+        index_store.refresh(fingerprint)
+        structure = get_structures(vector_db)[0]
+        annotate(chunks=len(vector_db.index_to_docstore_id), sections=len(structure.sections),
+                 requirements=len(structure.requirements))
+        return vector_db
+
+
+def load_vector_db(doc_fingerprint):
+    # 배치로 미리 만든 인덱스를 원문 없이 fingerprint만으로 불러옴
+    index_store = get_index_store()
+    vector_db = index_store.get(doc_fingerprint, get_embeddings())
+    if vector_db is not None:
+        get_lexical_index(vector_db)
+        if not get_structures(vector_db):
+            structure = _load_structure(doc_fingerprint)
+            if structure is not None:
+                attach_structure(vector_db, doc_fingerprint, structure)
+        index_store.refresh(doc_fingerprint)
+    return vector_db
+
+
+def structured_context(vector_db, topics, max_tokens, doc_ids=None, include_fields=False):
+    """문서 구조에서 주제별 절을 바로 꺼내 context를 만듦. 구조가 없거나 찾은 절이 예산에 비해 너무 적으면 None을 반환."""
+    structures = get_structures(vector_db, doc_ids)
+    if not structures:
+        return None
+    with track_step("structure_lookup"):
+        parts = []
+        for structure in structures:
+            if include_fields:
+                parts.append(structure.fields_text())
+            parts.extend(structure.section_text(section) for section in structure.topic_sections(topics))
+        context = pack_sections(parts, max_tokens)
+    # 제목 체계가 없거나 해당 절을 거의 찾지 못한 문서는 기존 검색으로 대신함
+    if count_tokens(context) < max_tokens * STRUCTURE_MIN_CONTEXT_RATIO:
+        return None
+    return context
+
+
+def _requirement_documents(vector_db, text, doc_ids=None):
+    # 요구사항 ID(SFR-001 등)가 나오면 요구사항 표에서 해당 요구사항 본문을 위치 그대로 가져옴
+    documents = []
+    for req_id in find_requirement_ids(text)[:MAX_REQUIREMENT_LOOKUPS]:
+        for structure in get_structures(vector_db, doc_ids):
+            entry = structure.requirement(req_id)
+            if entry:
+                documents.append(Document(
+                    page_content=structure.requirement_text(req_id),
+                    metadata={"doc_id": structure.doc_id, "start_index": entry["start"]},
+                ))
+    return documents
+
+
+# --- 단계별 결과 캐시 ---
+
+def _cached_stage_result(stage, doc_fingerprint, prompt_templates, temperature, inputs, compute):
+    # 문서 내용 해시 + 프롬프트/모델 설정이 모두 같을 때만 이전 결과를 재사용
+    result_cache = get_result_cache()
+    key = ResultCache.make_key(doc_fingerprint, stage, prompt_templates, LLM_MODEL, temperature, inputs)
+    with track_stage(stage):
+        result = result_cache.get(key)
+        record_cache(result is not None)
+        if result is None:
+            result = compute()
+            result_cache.put(key, doc_fingerprint, stage, result)
+        return result
+
+
+def _timed_stream(label, make_tokens):
+    # 단계 시작부터 첫 토큰이 나올 때까지의 시간(TTFT)을 기록하면서 토큰을 그대로 전달
+    started = time.perf_counter()
+    first_token = True
+    for token in make_tokens():
+        if first_token and token:
+            ttft = time.perf_counter() - started
+            logger.info("[%s] time to first token: %.2fs", label, ttft)
+            annotate(ttft=round(ttft, 4))
+            first_token = False
+        yield token
+
+
+def _cached_stage_stream(stage, doc_fingerprint, prompt_templates, temperature, inputs, compute_stream):
+    result_cache = get_result_cache()
+    key = ResultCache.make_key(doc_fingerprint, stage, prompt_templates, LLM_MODEL, temperature, inputs)
+    with track_stage(stage):
+        cached = result_cache.get(key)
+        record_cache(cached is not None)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        for token in _timed_stream(stage, compute_stream):
+            parts.append(token)
+            yield token
+        # 스트림이 끝까지 완료된 경우에만 캐시에 저장
+        result_cache.put(key, doc_fingerprint, stage, "".join(parts))
+
+
+def invalidate_cached_results(doc_fingerprint):
+    return get_result_cache().invalidate(doc_fingerprint)
+
+
+# --- 사업 개요 및 분석 단계 ---
+
+# 사업 개요에 사용할 절의 주제 (사업명/사업기간/사업예산은 구조에서 찾은 값을 앞에 붙임)
+SUMMARY_TOPICS = ("overview", "scope")
+
+
+def _summarize_project(vector_db, doc_ids=None):
+    budget = PROMPT_TOKEN_BUDGETS["summary"]["context"]
+    context = structured_context(vector_db, SUMMARY_TOPICS, budget, doc_ids, include_fields=True)
+    if context is None:
+        with track_step("retrieval"):
+            relevant_docs = hybrid_search(vector_db, "사업명, 사업개요, 추진배경, 사업목표", k=5, doc_ids=doc_ids)
+            context = pack_context(relevant_docs, budget)
+    prompt = PromptTemplate.from_template(PROJECT_SUMMARY_PROMPT)
+    chain = prompt | _chat_llm(0)
+    return _invoke(chain, {"context": context}, "generation").content
+
+
+def extract_project_summary(vector_db, doc_fingerprint, status=nullcontext, doc_ids=None):
+    def compute():
+        with status("사업의 핵심 개요를 추출 중입니다..."):
+            return _summarize_project(vector_db, doc_ids)
+    return _cached_stage_result(
+        "summary", doc_fingerprint, [PROJECT_SUMMARY_PROMPT], 0,
+        {"structure": STRUCTURE_VERSION, "topics": SUMMARY_TOPICS}, compute
+    )
+
+
+# 단계별 context 설정 (이전 단계 결과와 무관하므로 업로드 직후 미리 준비해 둘 수 있음)
+# topics: 문서 구조에서 바로 꺼낼 절의 주제(앞쪽 우선). 해당 절을 충분히 찾으면 아래 HyDE/검색 설정은 사용하지 않음
+# question: 구조에서 찾지 못한 문서에 사용할 HyDE 검색 질문
+# use_hyde: 가상 문서 생성 없이 하이브리드(벡터+BM25) 검색만으로 충분하면 False로 두어 LLM 호출 1회를 절약
+# keywords: BM25 검색에 함께 사용할 단계별 핵심 용어
+# mmr_lambda: 설정하면 서로 비슷한 chunk를 뒤로 미루어 context의 다양성을 높임
+STAGE_QUERIES = {
+    "risk": {
+        "question": "이 RFP를 분석하여, 제안사 입장에서의 잠재적 리스크와 도전 과제를 관리 전략과 함께 설명해줘.",
+        "topics": ("schedule", "contract", "security", "scope", "requirements"),
+        "search_k": 10,
+        "use_hyde": True,
+        "keywords": "리스크 위험 제약 일정 사업기간 예산 지체상금 하자보수 보안 연계 이관 요구사항 변경",
+    },
+    "ksf": {
+        "question": "이 RFP와 식별된 리스크를 바탕으로, 경쟁에서 승리하기 위한 핵심 성공 요소(KSF)를 도출해줘.",
+        "topics": ("evaluation", "overview", "expected", "requirements"),
+        "search_k": 10,
+        "use_hyde": True,
+        "keywords": "평가 기준 배점 기술평가 정량 정성 요구사항 차별화 사업 목표 기대효과",
+    },
+    "outline": {
+        "question": "이 RFP의 전반적인 내용과 목표, 요구사항을 종합하여 발표자료의 흐름을 잡아줘.",
+        "topics": ("overview", "scope", "schedule", "expected", "requirements"),
+        "search_k": 15,
+        "use_hyde": True,
+        "mmr_lambda": 0.7,  # 전체 흐름을 잡는 단계이므로 다양한 부분을 고르게 포함
+        "keywords": "사업명 추진 배경 사업 목적 사업 범위 요구사항 추진 일정 기대효과",
+    },
+}
+
+
+def retrieve_stage_context(vector_db, search_query, search_k=10, use_hyde=True, keywords="", max_tokens=6000, mmr_lambda=None,
+                           doc_ids=None):
+    query = search_query
+    if use_hyde:
+        hyde_prompt = PromptTemplate.from_template(HYDE_PROMPT)
+        hyde_chain = hyde_prompt | _chat_llm(0)
+        query = _invoke(hyde_chain, {"question": search_query}, "hyde").content
+    with track_step("retrieval"):
+        relevant_docs = hybrid_search(vector_db, query, k=search_k, lexical_query=f"{query}\n{keywords}", doc_ids=doc_ids)
+        return pack_context(relevant_docs, max_tokens, mmr_lambda=mmr_lambda)
+
+
+def _stage_settings(stage, use_hyde=None):
+    spec = {
+        "mmr_lambda": None, **STAGE_QUERIES[stage], "context_tokens": PROMPT_TOKEN_BUDGETS[stage]["context"],
+        "structure": STRUCTURE_VERSION,
+    }
+    if use_hyde is not None:
+        spec["use_hyde"] = use_hyde
+    return spec
+
+
+def run_analysis_with_inputs(vector_db, prompt_template, search_query, inputs, search_k=10, stream=False, context=None,
+                             use_hyde=True, keywords="", context_tokens=6000, mmr_lambda=None, doc_ids=None):
+    # 업로드 시 미리 검색해 둔 context가 있으면 HyDE 호출과 검색을 건너뜀
+    # doc_ids: 워크스페이스에서 분석 대상으로 고른 문서(document fingerprint)만 검색
+    if context is None:
+        context = retrieve_stage_context(
+            vector_db, search_query, search_k, use_hyde=use_hyde, keywords=keywords,
+            max_tokens=context_tokens, mmr_lambda=mmr_lambda, doc_ids=doc_ids
+        )
+    inputs['context'] = context
+    final_prompt = PromptTemplate.from_template(prompt_template)
+    final_chain = final_prompt | _chat_llm(ANALYSIS_TEMPERATURE) | StrOutputParser()
+    if stream:
+        return _stream(final_chain, inputs, "generation")
+    return _invoke(final_chain, inputs, "generation")
+
+
+def _cached_stage_context(vector_db, doc_fingerprint, stage, use_hyde=None, doc_ids=None):
+    """(단계 context, 문서 구조에서 꺼냈는지 여부)를 반환. 구조에서 찾지 못한 단계만 HyDE+검색 결과를 캐시에서 재사용."""
+    spec = _stage_settings(stage, use_hyde)
+    # 구조 조회는 LLM 호출 없이 끝나므로 캐시하지 않고, 조회 결과로 화면에 HyDE 설정이 적용되는지도 알려줌
+    with track_stage(f"structure:{stage}"):
+        context = structured_context(vector_db, spec["topics"], spec["context_tokens"], doc_ids)
+    if context is not None:
+        return context, True
+    return _cached_stage_result(
+        f"context:{stage}", doc_fingerprint, [HYDE_PROMPT], 0, spec,
+        lambda: retrieve_stage_context(
+            vector_db, spec["question"], spec["search_k"], use_hyde=spec["use_hyde"], keywords=spec["keywords"],
+            max_tokens=spec["context_tokens"], mmr_lambda=spec["mmr_lambda"], doc_ids=doc_ids
+        )
+    ), False
+
+
+def run_upload_pipeline(vector_db, doc_fingerprint, use_hyde=None, doc_ids=None):
+    """사업 개요 추출과 단계별 context 준비(문서 구조 조회, 찾지 못하면 HyDE 생성+검색)를 동시에 수행하여
+    (사업 개요, 단계별 context, 단계별 오류, 문서 구조에서 context를 꺼낸 단계 목록)을 반환.
+
+    사업 개요 추출에 실패하면 사업 개요는 None이고 오류는 errors["summary"]에 담긴다.
+    """
+    use_hyde = use_hyde or {}
+    with ThreadPoolExecutor(max_workers=1 + len(STAGE_QUERIES)) as executor:
+        summary_future = submit_with_context(executor, extract_project_summary, vector_db, doc_fingerprint, doc_ids=doc_ids)
+        context_futures = {
+            stage: submit_with_context(
+                executor, _cached_stage_context, vector_db, doc_fingerprint, stage, use_hyde.get(stage), doc_ids
+            )
+            for stage in STAGE_QUERIES
+        }
+    errors = {}
+    project_summary = None
+    try:
+        project_summary = summary_future.result()
+    except Exception as e:
+        errors["summary"] = e
+    stage_contexts, structured_stages = {}, []
+    for stage, future in context_futures.items():
+        try:
+            stage_contexts[stage], structured = future.result()
+        except Exception as e:
+            # 미리 검색하지 못한 단계는 단계 실행 시 기존 방식대로 검색
+            logger.warning("[%s] context prefetch failed: %s", stage, e)
+            errors[stage] = e
+            continue
+        if structured:
+            structured_stages.append(stage)
+    return project_summary, stage_contexts, errors, structured_stages
+
+
+def _run_cached_stage(stage, status_text, vector_db, doc_fingerprint, prompt_template, inputs, stream=False, context=None,
+                      use_hyde=None, status=nullcontext, doc_ids=None):
+    spec = _stage_settings(stage, use_hyde)
+    # 이전 단계 보고서가 길어도 프롬프트 예산을 넘지 않도록 항목별로 절단
+    budgets = PROMPT_TOKEN_BUDGETS[stage]
+    inputs = {name: truncate_to_tokens(value, budgets[name]) if name in budgets else value for name, value in inputs.items()}
+    cache_args = (
+        stage, doc_fingerprint, [HYDE_PROMPT, prompt_template], ANALYSIS_TEMPERATURE,
+        {**inputs, **spec},
+    )
+    run_kwargs = dict(
+        search_k=spec["search_k"], use_hyde=spec["use_hyde"], keywords=spec["keywords"],
+        context_tokens=spec["context_tokens"], mmr_lambda=spec["mmr_lambda"], doc_ids=doc_ids
+    )
+
+    def stage_context():
+        # 미리 준비한 context가 없으면 문서 구조에서 바로 꺼내고, 찾지 못하면 None을 넘겨 HyDE+검색을 수행
+        if context is not None:
+            return context
+        return structured_context(vector_db, spec["topics"], spec["context_tokens"], doc_ids)
+
+    if stream:
+        def compute_stream():
+            with status(status_text):
+                return run_analysis_with_inputs(
+                    vector_db, prompt_template, spec["question"], dict(inputs), stream=True, context=stage_context(),
+                    **run_kwargs
+                )
+        return _cached_stage_stream(*cache_args, compute_stream)
+
+    def compute():
+        with status(status_text):
+            return run_analysis_with_inputs(
+                vector_db, prompt_template, spec["question"], dict(inputs), context=stage_context(), **run_kwargs
+            )
+    return _cached_stage_result(*cache_args, compute)
+
+
+def generate_risk_report(vector_db, doc_fingerprint, stream=False, context=None, use_hyde=None, status=nullcontext,
+                         doc_ids=None):
+    return _run_cached_stage(
+        "risk", "단계 1: 리스크 분석...", vector_db, doc_fingerprint, RISK_ANALYSIS_PROMPT,
+        inputs={}, stream=stream, context=context, use_hyde=use_hyde, status=status, doc_ids=doc_ids
+    )
+
+
+def generate_ksf_report(vector_db, doc_fingerprint, final_risk_report, stream=False, context=None, use_hyde=None,
+                        status=nullcontext, doc_ids=None):
+    return _run_cached_stage(
+        "ksf", "단계 2: KSF 분석...", vector_db, doc_fingerprint, KSF_ANALYSIS_PROMPT,
+        inputs={"risk_report": final_risk_report}, stream=stream, context=context, use_hyde=use_hyde, status=status,
+        doc_ids=doc_ids
+    )
+
+
+def generate_outline_report(vector_db, doc_fingerprint, project_summary, final_risk_report, final_ksf_report, stream=False,
+                            context=None, use_hyde=None, status=nullcontext, doc_ids=None):
+    return _run_cached_stage(
+        "outline",
+        "단계 3: 목차 생성...",
+        vector_db,
+        doc_fingerprint,
+        HOLISTIC_PRESENTATION_STORYLINE_PROMPT,
+        inputs={
+            "project_summary": project_summary,
+            "risk_report": final_risk_report,
+            "ksf_report": final_ksf_report
+        },
+        stream=stream,
+        context=context,
+        use_hyde=use_hyde,
+        status=status,
+        doc_ids=doc_ids
+    )
+
+
+# --- 보고서 수정 ---
+
+ITEM_NUMBER_PATTERN = re.compile(r'^\s*(?:## |\*\*|\*\s+\*\*|\*\s+)?(\d+)\.\s')
+
+
+def parse_report_items(report_text):
+    if not report_text:
+        return "", []
+    pattern = re.compile(r'(?=\n\s*(?:## |\*\*|\*\s+\*\*|\*\s+)?\d+\.\s)', re.DOTALL)
+    items = pattern.split(report_text)
+    header = ""
+    if not items:
+        return "", []
+    first_item_check = ITEM_NUMBER_PATTERN.match(items[0].strip())
+    if not first_item_check:
+        header = items.pop(0).strip()
+    parsed_items = [item.strip() for item in items if item.strip()]
+    return header, parsed_items
+
+
+def refine_report_with_chat(vector_db, original_report, user_request, stream=False, doc_ids=None):
+    # 스트리밍 시에는 검색을 먼저 끝내고 생성은 소비하는 쪽에서 진행되므로 두 구간을 따로 기록
+    with track_stage("chat_retrieval"):
+        search_query = user_request + "\n\n" + original_report
+        relevant_docs = hybrid_search(vector_db, search_query, k=5, doc_ids=doc_ids)
+        # 요청에서 지목한 요구사항은 검색 결과보다 앞에 원문 그대로 넣음
+        relevant_docs = _requirement_documents(vector_db, user_request, doc_ids) + relevant_docs
+        retrieved_context = pack_context(relevant_docs, PROMPT_TOKEN_BUDGETS["chat"]["retrieved_context"])
+
+    prompt = PromptTemplate.from_template(GENERAL_REPORT_REFINEMENT_PROMPT)
+    chain = prompt | _chat_llm(ANALYSIS_TEMPERATURE) | StrOutputParser()
+
+    inputs = {
+        "original_report": original_report,
+        "retrieved_context": retrieved_context,
+        "user_request": user_request
+    }
+    if stream:
+        def tokens():
+            with track_stage("chat_refine"):
+                yield from _timed_stream("chat_refine", lambda: _stream(chain, inputs, "generation"))
+        return tokens()
+    with track_stage("chat_refine"):
+        return _invoke(chain, inputs, "generation")
+
+
+# "2번", "2, 3번 항목", "항목 2", "3. ..." 형태로 항목 번호를 지목한 요청을 인식 ("1장 분량", "3초" 같은 수량은 제외)
+# 요구사항 ID("SFR-003번")나 영문/숫자에 붙은 숫자는 항목 번호로 보지 않음
+REQUEST_ITEM_PATTERN = re.compile(r'(?<![A-Za-z0-9-])(\d+)\s*(?:번|\.\s)|항목\s*(\d+)')
+WHOLE_REPORT_KEYWORDS = ("전체", "전반", "모든 항목", "모두")
+
+
+def build_report(header, items):
+    return "\n\n".join(([header] if header else []) + items)
+
+
+def find_target_items(items, user_request):
+    requested = {int(a or b) for a, b in REQUEST_ITEM_PATTERN.findall(user_request)}
+    numbered, titled = [], []
+    for i, item in enumerate(items):
+        match = ITEM_NUMBER_PATTERN.match(item)
+        if match and int(match.group(1)) in requested:
+            numbered.append(i)
+            continue
+        # 번호 대신 항목 제목을 그대로 언급한 경우
+        title = re.sub(r'^[\s#*]*\d+\.\s*|[\[\]*#]', '', item.split("\n", 1)[0]).strip()
+        if len(title) >= 4 and title in user_request:
+            titled.append(i)
+    # 번호로 지목한 항목이 있으면 "전체", "모두"는 그 항목들의 범위를 뜻함 ("2번 항목 전체를", "2번과 3번 모두")
+    if not numbered and any(keyword in user_request for keyword in WHOLE_REPORT_KEYWORDS):
+        return []
+    return sorted(numbered + titled)
+
+
+def _refine_item(vector_db, header, item_text, user_request, doc_ids=None):
+    with track_step("retrieval"):
+        relevant_docs = hybrid_search(vector_db, f"{user_request}\n{item_text}", k=5, doc_ids=doc_ids)
+        relevant_docs = _requirement_documents(vector_db, f"{user_request}\n{item_text}", doc_ids) + relevant_docs
+        retrieved_context = pack_context(relevant_docs, PROMPT_TOKEN_BUDGETS["item"]["retrieved_context"])
+    prompt = PromptTemplate.from_template(ITEM_REFINEMENT_PROMPT)
+    chain = prompt | _chat_llm(ANALYSIS_TEMPERATURE) | StrOutputParser()
+    return _invoke(chain, {
+        "report_header": header,
+        "item_text": item_text,
+        "retrieved_context": retrieved_context,
+        "user_request": user_request
+    }, "generation").strip()
+
+
+def refine_report_items_with_chat(vector_db, original_report, user_request, doc_ids=None):
+    """요청이 지목한 항목만 다시 생성하여 보고서에 끼워 넣음. 대상 항목을 찾지 못하면 None을 반환."""
+    header, items = parse_report_items(original_report)
+    targets = find_target_items(items, user_request)
+    if not targets:
+        return None
+    new_items = list(items)
+    with track_stage("item_refine", items=len(targets)):
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = {
+                i: submit_with_context(executor, _refine_item, vector_db, header, items[i], user_request, doc_ids)
+                for i in targets
+            }
+        for i, future in futures.items():
+            new_items[i] = future.result()
+    return build_report(header, new_items), targets
+
+
+def make_report_patch(new_report, old_report):
+    # 새 보고서를 이전 버전으로 되돌리는 데 필요한 변경 구간(줄 단위)만 저장
+    new_lines = new_report.splitlines(keepends=True)
+    old_lines = old_report.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False)
+    return [(i1, i2, old_lines[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+def apply_report_patch(report, patch):
+    lines = report.splitlines(keepends=True)
+    for i1, i2, replacement in reversed(patch):
+        lines[i1:i2] = replacement
+    return "".join(lines)
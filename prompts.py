@@ -1,4 +1,14 @@
 # prompts.py
+# 프롬프트 입력 항목별 토큰 예산 (검색 결과 context와 이전 단계 보고서가 이 크기를 넘지 않도록 압축/절단)
+PROMPT_TOKEN_BUDGETS = {
+    "summary": {"context": 3000},
+    "risk": {"context": 6000},
+    "ksf": {"context": 5000, "risk_report": 3000},
+    "outline": {"context": 6000, "project_summary": 800, "risk_report": 2500, "ksf_report": 2500},
+    "chat": {"retrieved_context": 3000},
+    "item": {"retrieved_context": 2000},
+}
+
 # HyDE 전략: 검색 품질 향상을 위해 가상 답변을 생성하는 프롬프트
 HYDE_PROMPT = """
 당신은 주어진 질문에 대해 이상적인 답변이 어떤 모습일지 상상하여 가상의 문서를 작성하는 AI입니다.
@@ -135,5 +145,27 @@ GENERAL_REPORT_REFINEMENT_PROMPT = """
 **[수정된 최종 보고서]**
 """
 
+# 보고서의 특정 항목만 수정하기 위한 프롬프트
+ITEM_REFINEMENT_PROMPT = """
+당신은 사용자의 지시에 따라 분석 보고서의 **특정 항목 하나**만 수정하는 AI 편집자입니다.
 
-
+[작업 지침]
+1.  **[사용자 수정 요청]**을 **[수정 대상 항목]**에 반영하십시오. 다른 항목은 작성하지 마십시오.
+2.  항목의 번호, 제목 형식, 들여쓰기, 하위 항목 구조는 그대로 유지해야 합니다.
+3.  **[보고서 머리말]**의 맥락과 논리적으로 일관되게 작성하고, 근거는 **[관련 RFP 내용]**에서 찾으십시오.
+4.  당신의 최종 출력물은 **수정된 항목 텍스트만**이어야 합니다. 설명이나 인사말을 덧붙이지 마십시오.
+---
+[보고서 머리말]
+{report_header}
+---
+[수정 대상 항목]
+{item_text}
+---
+[관련 RFP 내용]
+{retrieved_context}
+---
+[사용자 수정 요청]
+{user_request}
+---
+**[수정된 항목]**
+"""
@@ -0,0 +1,254 @@
+# retrieval.py
+import re
+import math
+from collections import Counter, defaultdict
+from functools import lru_cache
+import tiktoken
+
+# 요구사항 ID(SFR-001), 금액/숫자(1,200,000,000), 영문 단어, 한글 어절을 토큰 후보로 사용
+TOKEN_PATTERN = re.compile(r"[a-z]+-\d+|\d+(?:[.,]\d+)*|[a-z]+|[가-힣]+")
+RRF_K = 60
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+NEAR_DUPLICATE_THRESHOLD = 0.85
+MIN_OVERLAP_CHARS = 30
+MAX_OVERLAP_CHARS = 400  # chunk_overlap(200)보다 넉넉하게
+MAX_MERGE_GAP_CHARS = 4  # splitter가 chunk 경계에서 지운 공백/줄바꿈("\n\n" 등) 길이만큼 떨어진 chunk도 이어진 것으로 봄
+TRUNCATION_MARKER = "\n...(이하 생략)"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4o"):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if not text:
+        return text
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    # 생략 표시까지 예산 안에 들어가도록 그만큼 덜 남김
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER))
+    return get_encoding().decode(tokens[:keep]).rstrip() + TRUNCATION_MARKER
+
+
+def tokenize(text, ngram=2):
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        if "가" <= word[0] <= "힣" and len(word) > ngram:
+            # 한글은 조사/어미가 붙어도 매칭되도록 문자 n-gram으로 분해
+            tokens.extend(word[i:i + ngram] for i in range(len(word) - ngram + 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class LexicalIndex:
+    """chunk 목록에 대한 BM25 인덱스 (한글은 문자 n-gram 기준)."""
+
+    def __init__(self, documents, ngram=2, k1=1.5, b=0.75):
+        self.documents = list(documents)
+        self.ngram = ngram
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(문서 번호, 빈도)]
+        self.doc_lengths = []
+        self.doc_id_counts = Counter(doc.metadata.get("doc_id") for doc in self.documents)  # 워크스페이스 문서별 chunk 수
+        for doc_id, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content, ngram))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                self.postings[term].append((doc_id, freq))
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def estimate_bytes(self):
+        # 게시 목록 항목(튜플 + 리스트 칸)과 용어별 dict/리스트/문자열 비용의 근사치 (chunk 본문은 docstore와 공유)
+        entries = sum(len(postings) for postings in self.postings.values())
+        return entries * 64 + len(self.postings) * 200 + len(self.doc_lengths) * 40
+
+    def search(self, query, k=10, doc_ids=None):
+        if not self.documents:
+            return []
+        scores = defaultdict(float)
+        total = len(self.documents)
+        for term in set(tokenize(query, self.ngram)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if doc_ids is not None:
+            ranked = [item for item in ranked if self.documents[item[0]].metadata.get("doc_id") in doc_ids]
+        return [self.documents[doc_id] for doc_id, _ in ranked[:k]]
+
+
+def get_lexical_index(vector_db):
+    # FAISS 인덱스에 붙여서 보관하고, chunk 수가 바뀌면 다시 생성 (워크스페이스는 문서 추가/삭제 시 직접 비움)
+    index = getattr(vector_db, "_lexical_index", None)
+    if index is None or len(index) != len(vector_db.index_to_docstore_id):
+        documents = [vector_db.docstore.search(doc_id) for doc_id in vector_db.index_to_docstore_id.values()]
+        index = LexicalIndex(documents)
+        vector_db._lexical_index = index
+    return index
+
+
+def reciprocal_rank_fusion(result_lists, k=10, rrf_k=RRF_K):
+    scores, documents = defaultdict(float), {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.page_content
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
+
+
+def hybrid_search(vector_db, query, k=10, lexical_query=None, doc_ids=None):
+    """벡터 검색과 BM25 검색 결과를 RRF로 합쳐 상위 k개 chunk를 반환. doc_ids를 주면 해당 문서의 chunk만 검색."""
+    fetch_k = k * 2
+    lexical_index = get_lexical_index(vector_db)
+    if doc_ids is None:
+        dense_results = vector_db.similarity_search(query, k=fetch_k)
+    else:
+        doc_ids = set(doc_ids)
+        # FAISS 필터는 검색 후에 적용되므로, 선택한 문서가 전체에서 차지하는 비율만큼 후보를 넉넉히 가져옴
+        selected = sum(lexical_index.doc_id_counts.get(doc_id, 0) for doc_id in doc_ids)
+        candidates = min(len(lexical_index), fetch_k * max(1, len(lexical_index) // max(1, selected)))
+        dense_results = vector_db.similarity_search(
+            query, k=fetch_k, fetch_k=candidates, filter=lambda metadata: metadata.get("doc_id") in doc_ids
+        )
+    lexical_results = lexical_index.search(lexical_query or query, k=fetch_k, doc_ids=doc_ids)
+    return reciprocal_rank_fusion([dense_results, lexical_results], k=k)
+
+
+def _shingles(text, size=3):
+    text = re.sub(r"\s+", " ", text)
+    return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _text_overlap(left, right):
+    # left의 끝부분과 right의 앞부분이 겹치는 길이 (splitter overlap으로 생긴 중복)
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_overlapping(texts_with_meta):
+    """인접하거나 겹치는 chunk를 하나로 합침. start_index 메타데이터가 있으면 위치로, 없으면 텍스트로 판단."""
+    # (검색 순위, 텍스트, 문서 키, 시작 위치): 같은 문서 키의 chunk끼리만 합침
+    entries = [list(entry) for entry in texts_with_meta]
+    positioned = sorted((e for e in entries if e[3] is not None), key=lambda e: (str(e[2]), e[3]))
+    merged = [e for e in entries if e[3] is None]
+    for entry in positioned:
+        previous = merged[-1] if merged and merged[-1][3] is not None else None
+        gap = entry[3] - (previous[3] + len(previous[1])) if previous and previous[2] == entry[2] else None
+        if gap is not None and gap <= MAX_MERGE_GAP_CHARS:
+            # 겹치면 겹친 만큼 빼고, 떨어져 있으면 지워진 공백 자리를 줄바꿈으로 채워 이어 붙임 (위치가 원문과 어긋나지 않도록)
+            previous[1] += entry[1][-gap:] if gap < 0 else "\n" * gap + entry[1]
+            previous[0] = min(previous[0], entry[0])
+        else:
+            merged.append(entry)
+    merged.sort(key=lambda e: e[0])
+    # 위치 정보가 없는 chunk는 텍스트 앞뒤 중복으로 이어 붙임
+    result = []
+    for entry in merged:
+        for kept in result:
+            if kept[2] != entry[2]:
+                continue
+            overlap = _text_overlap(kept[1], entry[1])
+            if overlap:
+                kept[1] += entry[1][overlap:]
+                break
+            overlap = _text_overlap(entry[1], kept[1])
+            if overlap:
+                kept[1] = entry[1] + kept[1][overlap:]
+                break
+        else:
+            result.append(entry)
+    return result
+
+
+def pack_context(documents, max_tokens, separator=CONTEXT_SEPARATOR, mmr_lambda=None):
+    """검색된 chunk를 합치고(겹침 병합, 유사 중복 제거, 선택적 MMR 재정렬) 토큰 예산 안에 들어가도록 이어 붙임."""
+    # 워크스페이스에서는 같은 파일명으로 올린 수정본/변경 공고도 doc_id가 다르므로 doc_id로 문서를 구분
+    entries = _merge_overlapping(
+        (rank, doc.page_content, doc.metadata.get("doc_id") or doc.metadata.get("source"), doc.metadata.get("start_index"))
+        for rank, doc in enumerate(documents)
+    )
+    candidates = [(entry[1], _shingles(entry[1])) for entry in entries]
+    if mmr_lambda is not None:
+        candidates = _mmr_order(candidates, mmr_lambda)
+
+    parts, used = [], 0
+    kept_shingles = []
+    separator_tokens = count_tokens(separator)
+    for text, shingles in candidates:
+        if any(_similarity(shingles, kept) >= NEAR_DUPLICATE_THRESHOLD for kept in kept_shingles):
+            continue
+        remaining = max_tokens - used - (separator_tokens if parts else 0)
+        if remaining <= 0:
+            break
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            # 남은 예산이 너무 작으면 잘린 조각을 넣지 않음
+            if remaining >= 200:
+                parts.append(truncate_to_tokens(text, remaining))
+            break
+        parts.append(text)
+        kept_shingles.append(shingles)
+        used += tokens + (separator_tokens if len(parts) > 1 else 0)
+    return separator.join(parts)
+
+
+def pack_sections(texts, max_tokens, separator=CONTEXT_SEPARATOR):
+    """절 단위 텍스트를 순서대로 이어 붙임. 예산을 넘으면 짧은 절은 그대로 두고 남은 예산을 긴 절끼리 똑같이 나누어 자름."""
+    texts = [text for text in texts if text]
+    if not texts:
+        return ""
+    sizes = [count_tokens(text) for text in texts]
+    limits = [0] * len(texts)
+    remaining = max_tokens - count_tokens(separator) * (len(texts) - 1)
+    order = sorted(range(len(texts)), key=sizes.__getitem__)
+    for n, i in enumerate(order):
+        limits[i] = min(sizes[i], max(0, remaining) // (len(order) - n))
+        remaining -= limits[i]
+    return separator.join(
+        text if limits[i] == sizes[i] else truncate_to_tokens(text, limits[i])
+        for i, text in enumerate(texts) if limits[i] > 0
+    )
+
+
+def _mmr_order(candidates, mmr_lambda):
+    # 검색 순위를 관련도로 보고, 이미 고른 chunk와 비슷한 chunk는 뒤로 미룸
+    remaining = list(enumerate(candidates))
+    ordered, selected = [], []
+    while remaining:
+        def score(item):
+            rank, (_, shingles) = item
+            redundancy = max((_similarity(shingles, s) for s in selected), default=0.0)
+            return mmr_lambda / (rank + 1) - (1 - mmr_lambda) * redundancy
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        ordered.append(best[1])
+        selected.append(best[1][1])
+    return ordered
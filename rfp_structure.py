@@ -0,0 +1,236 @@
+# rfp_structure.py
+import re
+import sys
+
+STRUCTURE_VERSION = 3
+
+# 제목 줄 앞뒤의 마크다운/글머리 기호 (정제 단계에서 "## 1. 사업 개요", "**1. 사업 개요**" 형태로 바뀔 수 있음)
+HEADING_DECORATION = re.compile(r"^[\s#*_]+|[\s*_]+$")
+MARKDOWN_HEADING = re.compile(r"^\s*(#{1,6})\s")
+# (패턴, 수준): 장/로마 숫자 > 1. > 1.1 > 1.1.1 > 가.
+HEADING_PATTERNS = [
+    (re.compile(r"^제\s*\d+\s*[장편부]\.?\s*(.*)$"), 1),
+    (re.compile(r"^(?:[IVX]+|[Ⅰ-Ⅻ])\.\s*(.+)$"), 1),
+    (re.compile(r"^\d+\.\d+\.\d+\.?\s+(.+)$"), 4),
+    (re.compile(r"^\d+\.\d+\.?\s+(.+)$"), 3),
+    (re.compile(r"^\d+\.\s+(.+)$"), 2),
+    (re.compile(r"^[가-하]\.\s+(.+)$"), 5),
+]
+MAX_HEADING_CHARS = 40  # 이보다 긴 줄, 문장으로 끝나는 줄, "라벨: 값" 형태의 줄은 번호 목록의 본문으로 봄
+NOT_HEADING = re.compile(r"(?:다|함|음)\s*[.。]?$|[.。]$|[:：]")
+
+# 한국 공공 RFP의 요구사항 분류 코드 (기능, 장비, 성능, 인터페이스, 데이터, 테스트, 보안, 품질, 제약, 관리, 지원)
+REQUIREMENT_CATEGORIES = ("SFR", "ECR", "PER", "INR", "DAR", "TER", "SER", "QUR", "COR", "PMR", "PSR", "CSR")
+# 채팅에서 소문자로 적은 ID("sfr-001")도 찾도록 대소문자를 구분하지 않고, 정규화할 때 대문자로 맞춤
+REQUIREMENT_ID_PATTERN = re.compile(
+    rf"(?<![A-Za-z0-9])({'|'.join(REQUIREMENT_CATEGORIES)})\s*-\s*(\d{{2,4}})(?!\d)", re.IGNORECASE
+)
+REQUIREMENT_DEFINITION_HINT = re.compile(r"고유\s*번호|요구사항\s*(?:번호|ID|id)")
+# 표가 정제된 "| 요구사항 명칭 | 로그인 |" 형태에서는 값 뒤의 칸 구분자를 뺌
+REQUIREMENT_NAME_PATTERN = re.compile(r"요구사항\s*(?:명칭|명)\s*[:：|]\s*(?:\*\*)?\s*(.+?)[\s|*]*$", re.MULTILINE)
+LINE_PREFIX = re.compile(r"^[\s|*#\-·•○□◦▪]*")
+
+# 라벨: 값 형태로 적히는 사업 기본 정보 (표가 정제되어 "| 사업명 | ... |"가 된 경우 포함)
+FIELD_LABELS = {
+    "사업명": r"사업\s*명|과업\s*명|용역\s*명",
+    "사업기간": r"사업\s*기간|계약\s*기간|수행\s*기간|과업\s*기간",
+    "사업예산": r"사업\s*예산|소요\s*예산|배정\s*예산|사업\s*금액|추정\s*금액|사업비",
+}
+FIELD_PATTERNS = {
+    name: re.compile(
+        rf"^[\s|*#\-·•○□◦▪]*(?:\d+[.)]\s*|[가-하][.)]\s*)?(?:\*\*)?(?:{labels})(?:\*\*)?\s*[:：|]\s*(?:\*\*)?\s*"
+        rf"(?P<value>.+?)[\s|*]*$"
+    )
+    for name, labels in FIELD_LABELS.items()
+}
+
+# 절 제목(공백 제거)에 포함되면 해당 주제로 분류하는 키워드
+TOPIC_KEYWORDS = {
+    "overview": ("사업개요", "추진배경", "필요성", "사업목적", "사업목표", "추진목적", "추진목표"),
+    "scope": ("사업범위", "추진범위", "구축범위", "과업범위", "과업내용", "제안요청내용", "사업내용"),
+    "schedule": ("추진일정", "사업일정", "추진체계", "추진방안", "추진전략"),
+    "requirements": ("요구사항",),
+    "security": ("보안",),
+    "evaluation": ("평가", "배점"),
+    "contract": ("계약", "하자", "지체상금", "검수", "대금", "유의사항", "특수조건", "준수사항", "제출"),
+    "expected": ("기대효과",),
+}
+
+
+def normalize_requirement_id(category, number):
+    return f"{category.upper()}-{number}"
+
+
+def find_requirement_ids(text):
+    """텍스트에 나온 요구사항 ID를 처음 나온 순서대로 중복 없이 반환."""
+    seen = {}
+    for match in REQUIREMENT_ID_PATTERN.finditer(text or ""):
+        seen.setdefault(normalize_requirement_id(match.group(1), match.group(2)), None)
+    return list(seen)
+
+
+def _iter_lines(text):
+    position = 0
+    for line in text.splitlines(keepends=True):
+        yield position, line.rstrip("\r\n")
+        position += len(line)
+
+
+def _heading(line):
+    markdown = MARKDOWN_HEADING.match(line)
+    title = HEADING_DECORATION.sub("", line)
+    if not title:
+        return None
+    for pattern, level in HEADING_PATTERNS:
+        match = pattern.match(title)
+        if match:
+            if len(title) > MAX_HEADING_CHARS or NOT_HEADING.search(title):
+                return None
+            return title, level
+    if markdown and len(title) <= MAX_HEADING_CHARS and not NOT_HEADING.search(title):
+        return title, len(markdown.group(1))
+    return None
+
+
+class RfpStructure:
+    """RFP 텍스트의 절(section) 트리, 요구사항 ID 표, 사업 기본 정보(사업명/사업기간/사업예산)의 위치를 담는 구조 색인.
+
+    모든 위치는 원문 기준 [start, end) 문자 오프셋이다. 주제별 절, 요구사항, 기본 정보는 파싱할 때 만든 사전으로 바로 찾는다.
+    """
+
+    def __init__(self, text, sections, requirements, fields, topics, doc_id=None):
+        self.text = text
+        self.sections = sections  # [{"title", "level", "start", "end", "parent", "children"}]
+        self.requirements = requirements  # ID -> {"id", "category", "name", "start", "end", "section", "mentions"}
+        self.fields = fields  # 이름 -> {"value", "start", "end"}
+        self.topics = topics  # 주제 -> [절 번호]
+        self.doc_id = doc_id  # chunk의 doc_id와 같은 값을 붙여 context 병합 단위를 맞춤 (인덱스에 붙일 때 지정)
+
+    @classmethod
+    def parse(cls, text):
+        sections, fields, candidates, mentions = [], {}, [], {}
+        stack = []
+        for position, line in _iter_lines(text):
+            heading = _heading(line)
+            if heading:
+                title, level = heading
+                while stack and sections[stack[-1]]["level"] >= level:
+                    sections[stack.pop()]["end"] = position
+                parent = stack[-1] if stack else None
+                sections.append({"title": title, "level": level, "start": position, "end": len(text), "parent": parent,
+                                 "children": []})
+                if parent is not None:
+                    sections[parent]["children"].append(len(sections) - 1)
+                stack.append(len(sections) - 1)
+            for name, pattern in FIELD_PATTERNS.items():
+                if name in fields:
+                    continue
+                match = pattern.match(line)
+                if match:
+                    fields[name] = {
+                        "value": match.group("value").strip(),
+                        "start": position + match.start("value"),
+                        "end": position + match.end("value"),
+                    }
+            for match in REQUIREMENT_ID_PATTERN.finditer(line):
+                req_id = normalize_requirement_id(match.group(1), match.group(2))
+                mentions.setdefault(req_id, []).append(position + match.start())
+            # "요구사항 고유번호: SFR-001"이나 줄 맨 앞(표의 첫 칸 포함)에 나온 ID를 요구사항 정의 후보로 봄
+            match = REQUIREMENT_ID_PATTERN.search(line)
+            if match:
+                strength = 2 if REQUIREMENT_DEFINITION_HINT.search(line[:match.start()]) else (
+                    1 if match.start() == LINE_PREFIX.match(line).end() else 0)
+                if strength:
+                    req_id = normalize_requirement_id(match.group(1), match.group(2))
+                    candidates.append((req_id, position, stack[-1] if stack else None, strength))
+
+        # ID마다 가장 확실한(고유번호 표기 > 줄 맨 앞) 첫 후보를 정의 위치로 고름 (앞쪽 총괄표의 한 줄보다 본문 정의를 우선)
+        best = {}
+        for i, (req_id, _, _, strength) in enumerate(candidates):
+            if req_id not in best or strength > candidates[best[req_id]][3]:
+                best[req_id] = i
+        requirements = {}
+        for req_id, i in best.items():
+            _, start, section, _ = candidates[i]
+            # 다음 요구사항 후보 또는 속한 절의 끝까지를 요구사항 본문으로 봄
+            end = candidates[i + 1][1] if i + 1 < len(candidates) else len(text)
+            if section is not None:
+                end = min(end, sections[section]["end"])
+            body = text[start:end]
+            name_match = REQUIREMENT_NAME_PATTERN.search(body)
+            requirements[req_id] = {
+                "id": req_id,
+                "category": req_id.split("-")[0],
+                "name": name_match.group(1).strip() if name_match else "",
+                "start": start,
+                "end": end,
+                "section": section,
+                "mentions": mentions[req_id],
+            }
+        return cls(text, sections, requirements, fields, cls._classify(sections))
+
+    @staticmethod
+    def _classify(sections):
+        topics = {}
+        for index, section in enumerate(sections):
+            compact = re.sub(r"\s+", "", section["title"])
+            for topic, keywords in TOPIC_KEYWORDS.items():
+                if not any(keyword in compact for keyword in keywords):
+                    continue
+                # 상위 절이 이미 같은 주제로 분류되었으면 하위 절은 그 안에 포함되므로 건너뜀
+                parent = section["parent"]
+                while parent is not None and parent not in topics.get(topic, ()):
+                    parent = sections[parent]["parent"]
+                if parent is None:
+                    topics.setdefault(topic, []).append(index)
+        return topics
+
+    def estimate_bytes(self):
+        # 원문 사본과 절/요구사항 항목(dict) 비용의 근사치
+        return sys.getsizeof(self.text) + (len(self.sections) + len(self.requirements)) * 700
+
+    def to_dict(self):
+        return {
+            "version": STRUCTURE_VERSION,
+            "text": self.text,
+            "sections": self.sections,
+            "requirements": self.requirements,
+            "fields": self.fields,
+            "topics": self.topics,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # 파서가 바뀌어 형식이 다르면 None을 반환하여 다시 파싱하도록 함
+        if not data or data.get("version") != STRUCTURE_VERSION:
+            return None
+        return cls(data["text"], data["sections"], data["requirements"], data["fields"], data["topics"])
+
+    def section_text(self, section):
+        return self.text[section["start"]:section["end"]].strip()
+
+    def sections_for(self, topic):
+        return [self.sections[index] for index in self.topics.get(topic, ())]
+
+    def topic_sections(self, topics):
+        """주제 순서대로 절을 고르되 이미 고른 절과 겹치는(상위/하위) 절은 빼고, 문서 순서로 정렬하여 반환."""
+        selected = []
+        for topic in topics:
+            for section in self.sections_for(topic):
+                if all(section["end"] <= kept["start"] or section["start"] >= kept["end"] for kept in selected):
+                    selected.append(section)
+        return sorted(selected, key=lambda section: section["start"])
+
+    def requirement(self, req_id):
+        return self.requirements.get(req_id)
+
+    def requirement_text(self, req_id):
+        entry = self.requirements.get(req_id)
+        return self.text[entry["start"]:entry["end"]].strip() if entry else None
+
+    def field(self, name):
+        entry = self.fields.get(name)
+        return entry["value"] if entry else None
+
+    def fields_text(self):
+        return "\n".join(f"{name}: {self.fields[name]['value']}" for name in FIELD_LABELS if name in self.fields)
@@ -1,162 +1,119 @@
 # utils.py
+# Streamlit 화면용 래퍼: 파이프라인 본체는 pipeline.py에 있고, 여기서는 스피너/진행률/오류 표시만 담당
 import os
-import re
 import streamlit as st
-import fitz
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from langchain_core.output_parsers import StrOutputParser
-from langchain_community.vectorstores import FAISS
-from prompts import (
-    PROJECT_SUMMARY_PROMPT, RISK_ANALYSIS_PROMPT, KSF_ANALYSIS_PROMPT,
-    HOLISTIC_PRESENTATION_STORYLINE_PROMPT, HYDE_PROMPT,
-    TEXT_REFINEMENT_PROMPT, GENERAL_REPORT_REFINEMENT_PROMPT # 수정됨
+import pipeline
+from pipeline import (
+    STAGE_QUERIES, parse_report_items, refine_report_with_chat, refine_report_items_with_chat,
+    make_report_patch, apply_report_patch, get_result_cache, invalidate_cached_results
 )
 
-API_KEY = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
+def _read_api_key():
+    # secrets.toml이 없는 환경(벤치마크, 스크립트 실행 등)에서는 환경 변수만 사용
+    try:
+        return st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
+    except FileNotFoundError:
+        return os.getenv("OPENAI_API_KEY")
+
+pipeline.set_api_key(_read_api_key())
+
+def refine_pages_with_ai(pages):
+    progress = st.progress(0.0, text="AI가 OCR 추출 텍스트를 자동으로 정제하고 있습니다...")
+    def on_progress(done, total):
+        progress.progress(done / total, text=f"AI 텍스트 정제 중... ({done}/{total} 구간)")
+    segments, failed = pipeline.refine_pages(pages, on_progress)
+    progress.empty()
+    if failed:
+        window_numbers = ", ".join(str(n) for n, _ in failed)
+        st.warning(f"{len(failed)}개 구간({window_numbers}번)의 AI 정제 중 오류가 발생하여 해당 구간은 원본 텍스트를 사용합니다. ({failed[0][1]})")
+    return segments
 
-@st.cache_data(show_spinner="AI가 OCR 추출 텍스트를 자동으로 정제하고 있습니다...")
-def refine_text_with_ai(text_to_refine):
-    if not text_to_refine or not text_to_refine.strip():
-        return ""
+def extract_document(uploaded_file):
+    """(원본 텍스트, 정제 텍스트, 정제 구간별 [(첫 페이지, 마지막 페이지, 텍스트)])를 반환."""
     try:
-        llm = ChatOpenAI(model="gpt-4o", temperature=0, openai_api_key=API_KEY)
-        prompt = PromptTemplate.from_template(TEXT_REFINEMENT_PROMPT)
-        chain = prompt | llm | StrOutputParser()
-        refined_text = chain.invoke({"raw_text": text_to_refine})
-        return refined_text
+        pages = pipeline.extract_pages(uploaded_file.getvalue(), uploaded_file.type)
     except Exception as e:
-        st.error(f"AI 텍스트 정제 중 오류 발생: {e}")
-        st.warning("원본 텍스트를 그대로 사용하여 분석을 진행합니다.")
-        return text_to_refine
+        st.error(f"PDF 텍스트 추출 중 오류: {e}")
+        return None, None, None
 
-def extract_text_from_file(uploaded_file):
-    raw_text = None
-    if uploaded_file.type == "application/pdf":
-        try:
-            file_bytes = uploaded_file.getvalue()
-            doc = fitz.open(stream=file_bytes, filetype="pdf")
-            full_text = ""
-            for page in doc:
-                blocks = page.get_text("blocks", sort=True)
-                blocks.sort(key=lambda b: (b[1], b[0]))
-                full_text += "\n".join([b[4] for b in blocks if b[4].strip()]) + "\n\n"
-            doc.close()
-            raw_text = re.sub(r'\n\s*\n', '\n\n', full_text).strip()
-        except Exception as e:
-            st.error(f"PDF 텍스트 추출 중 오류: {e}")
-            return None, None
-    elif uploaded_file.type == "text/plain":
-        raw_text = uploaded_file.getvalue().decode("utf-8")
-    
+    raw_text = "\n\n".join(text for _, text in pages)
     if raw_text:
         if uploaded_file.type == "application/pdf":
-            refined_text = refine_text_with_ai(raw_text)
-            return raw_text, refined_text
+            segments = refine_pages_with_ai(pages)
+            return raw_text, pipeline.join_segments(segments), segments
         else:
-            return raw_text, raw_text
-            
-    return None, None
+            return raw_text, raw_text, [(None, None, raw_text)]
+
+    if uploaded_file.type == "application/pdf" and not pipeline.ocr_available():
+        st.warning("PDF에서 텍스트를 찾지 못했습니다. 스캔 문서는 tesseract-ocr(kor) 설치 후 OCR로 추출할 수 있습니다.")
+    return None, None, None
+
+def extract_text_from_file(uploaded_file):
+    raw_text, refined_text, _ = extract_document(uploaded_file)
+    return raw_text, refined_text
+
+def add_to_workspace(workspace, uploaded_file):
+    raw_text, refined_text, segments = extract_document(uploaded_file)
+    if not refined_text:
+        return None
+    return add_text_to_workspace(workspace, uploaded_file.name, refined_text, segments)
+
+def add_text_to_workspace(workspace, name, refined_text, segments=None):
+    try:
+        with st.spinner(f"'{name}'을(를) 워크스페이스에 추가 중입니다..."):
+            return workspace.add_document(name, refined_text, segments)
+    except Exception as e:
+        st.error(f"워크스페이스에 문서를 추가하는 중 오류: {e}")
+        return None
 
-@st.cache_resource(show_spinner="문서를 분석하여 AI가 이해할 수 있도록 준비 중입니다...")
 def create_vector_db(refined_text):
-    if not refined_text: return None
     try:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-        chunks = text_splitter.split_text(refined_text)
-        doc_chunks = [Document(page_content=t) for t in chunks]
-        embeddings = OpenAIEmbeddings(api_key=API_KEY)
-        vector_db = FAISS.from_documents(doc_chunks, embeddings)
-        return vector_db
+        return pipeline.create_vector_db(refined_text, status=st.spinner)
     except Exception as e:
         st.error(f"벡터 DB 생성 중 오류: {e}")
         return None
 
-@st.cache_data(show_spinner="사업의 핵심 개요를 추출 중입니다...")
-def extract_project_summary(_vector_db):
-    if not _vector_db: return "사업 개요 정보를 추출할 수 없습니다."
+def load_vector_db(doc_fingerprint):
+    try:
+        return pipeline.load_vector_db(doc_fingerprint)
+    except Exception as e:
+        st.error(f"저장된 벡터 DB를 불러오는 중 오류: {e}")
+        return None
+
+def extract_project_summary(vector_db, doc_fingerprint):
+    if not vector_db: return "사업 개요 정보를 추출할 수 없습니다."
     try:
-        retriever = _vector_db.as_retriever(search_kwargs={'k': 5})
-        relevant_docs = retriever.get_relevant_documents("사업명, 사업개요, 추진배경, 사업목표")
-        context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
-        llm = ChatOpenAI(model="gpt-4o", temperature=0, openai_api_key=API_KEY)
-        prompt = PromptTemplate.from_template(PROJECT_SUMMARY_PROMPT)
-        chain = prompt | llm
-        summary = chain.invoke({"context": context}).content
-        return summary
+        return pipeline.extract_project_summary(vector_db, doc_fingerprint, status=st.spinner)
     except Exception as e:
         st.error(f"사업 개요 추출 중 오류: {e}")
         return "사업 개요 추출 중 오류가 발생했습니다."
 
-def run_analysis_with_inputs(vector_db, prompt_template, search_query, inputs, search_k=10):
-    hyde_llm = ChatOpenAI(model="gpt-4o", temperature=0, openai_api_key=API_KEY)
-    hyde_prompt = PromptTemplate.from_template(HYDE_PROMPT)
-    hyde_chain = hyde_prompt | hyde_llm
-    hypothetical_document = hyde_chain.invoke({"question": search_query}).content
-    retriever = vector_db.as_retriever(search_kwargs={'k': search_k})
-    relevant_docs = retriever.get_relevant_documents(hypothetical_document)
-    inputs['context'] = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
-    final_llm = ChatOpenAI(model="gpt-4o", temperature=0.3, openai_api_key=API_KEY)
-    final_prompt = PromptTemplate.from_template(prompt_template)
-    final_chain = final_prompt | final_llm
-    response = final_chain.invoke(inputs)
-    return response.content
-
-@st.cache_data(show_spinner="단계 1: 리스크 분석...")
-def generate_risk_report(_vector_db):
-    question = "이 RFP를 분석하여, 제안사 입장에서의 잠재적 리스크와 도전 과제를 관리 전략과 함께 설명해줘."
-    return run_analysis_with_inputs(_vector_db, RISK_ANALYSIS_PROMPT, question, inputs={})
-
-@st.cache_data(show_spinner="단계 2: KSF 분석...")
-def generate_ksf_report(_vector_db, final_risk_report):
-    question = "이 RFP와 식별된 리스크를 바탕으로, 경쟁에서 승리하기 위한 핵심 성공 요소(KSF)를 도출해줘."
-    return run_analysis_with_inputs(_vector_db, KSF_ANALYSIS_PROMPT, question, inputs={"risk_report": final_risk_report})
-
-@st.cache_data(show_spinner="단계 3: 목차 생성...")
-def generate_outline_report(_vector_db, project_summary, final_risk_report, final_ksf_report):
-    question = "이 RFP의 전반적인 내용과 목표, 요구사항을 종합하여 발표자료의 흐름을 잡아줘."
-    return run_analysis_with_inputs(
-        _vector_db,
-        HOLISTIC_PRESENTATION_STORYLINE_PROMPT,
-        question,
-        inputs={
-            "project_summary": project_summary,
-            "risk_report": final_risk_report,
-            "ksf_report": final_ksf_report
-        },
-        search_k=15
+def run_upload_pipeline(vector_db, doc_fingerprint, use_hyde=None, doc_ids=None):
+    """업로드 직후 사업 개요 추출과 단계별 HyDE 생성+검색을 동시에 수행하여
+    (사업 개요, 단계별 context, 문서 구조에서 context를 꺼낸 단계 목록)을 반환."""
+    project_summary, stage_contexts, errors, structured_stages = pipeline.run_upload_pipeline(
+        vector_db, doc_fingerprint, use_hyde, doc_ids
     )
+    if "summary" in errors:
+        st.error(f"사업 개요 추출 중 오류: {errors['summary']}")
+        project_summary = "사업 개요 추출 중 오류가 발생했습니다."
+    return project_summary, stage_contexts, structured_stages
 
-def parse_report_items(report_text):
-    if not report_text:
-        return "", []
-    pattern = re.compile(r'(?=\n\s*(?:## |\*\*|\* \*\*|\* )?\d+\.\s)', re.DOTALL)
-    items = pattern.split(report_text)
-    header = ""
-    if not items:
-        return "", []
-    first_item_check = re.match(r'^\s*(?:## |\*\*|\* \*\*|\* )?\d+\.\s', items[0].strip())
-    if not first_item_check:
-        header = items.pop(0).strip()
-    parsed_items = [item.strip() for item in items if item.strip()]
-    return header, parsed_items
-
-# [수정됨] 잠금 기능이 제거된 보고서 전체 수정 함수
-def refine_report_with_chat(vector_db, original_report, user_request):
-    retriever = vector_db.as_retriever(search_kwargs={'k': 5})
-    search_query = user_request + "\n\n" + original_report
-    relevant_docs = retriever.get_relevant_documents(search_query)
-    retrieved_context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
-    
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.3, openai_api_key=API_KEY)
-    prompt = PromptTemplate.from_template(GENERAL_REPORT_REFINEMENT_PROMPT)
-    chain = prompt | llm | StrOutputParser()
-    
-    response = chain.invoke({
-        "original_report": original_report,
-        "retrieved_context": retrieved_context,
-        "user_request": user_request
-    })
-    return response
+def generate_risk_report(vector_db, doc_fingerprint, stream=False, context=None, use_hyde=None, doc_ids=None):
+    return pipeline.generate_risk_report(
+        vector_db, doc_fingerprint, stream=stream, context=context, use_hyde=use_hyde, status=st.spinner, doc_ids=doc_ids
+    )
+
+def generate_ksf_report(vector_db, doc_fingerprint, final_risk_report, stream=False, context=None, use_hyde=None,
+                        doc_ids=None):
+    return pipeline.generate_ksf_report(
+        vector_db, doc_fingerprint, final_risk_report, stream=stream, context=context, use_hyde=use_hyde, status=st.spinner,
+        doc_ids=doc_ids
+    )
+
+def generate_outline_report(vector_db, doc_fingerprint, project_summary, final_risk_report, final_ksf_report, stream=False,
+                            context=None, use_hyde=None, doc_ids=None):
+    return pipeline.generate_outline_report(
+        vector_db, doc_fingerprint, project_summary, final_risk_report, final_ksf_report,
+        stream=stream, context=context, use_hyde=use_hyde, status=st.spinner, doc_ids=doc_ids
+    )
@@ -0,0 +1,76 @@
+# workspace.py
+import threading
+from langchain_community.vectorstores import FAISS
+from cache import content_hash
+from index_store import document_fingerprint
+from instrumentation import track_stage, track_step, annotate
+from rfp_structure import RfpStructure
+import pipeline
+
+
+def workspace_fingerprint(doc_ids):
+    # 분석 대상 문서 조합이 같으면 같은 캐시 키를 사용 (문서 하나만 골라도 단일 문서 분석과는 구분)
+    return content_hash("workspace", *sorted(doc_ids))
+
+
+class Workspace:
+    """여러 문서(RFP, 변경 공고, 질의응답, 첨부 등)를 하나의 FAISS 인덱스에 점진적으로 추가/삭제하는 작업 공간.
+
+    chunk마다 source(파일명), doc_id(document fingerprint), page/page_end 메타데이터를 붙여
+    검색 시 doc_ids로 문서를 골라낼 수 있다. 문서를 삭제해도 나머지 문서는 다시 임베딩하지 않는다.
+    문서마다 구조(절 트리, 요구사항 ID 표)도 만들어 인덱스에 붙여 두므로, 고른 문서들의 절을 검색 없이 꺼낼 수 있다.
+    """
+
+    def __init__(self):
+        self.vector_db = None
+        self.documents = {}  # doc_id -> {"name", "chunk_ids", "pages"}
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def doc_ids(self):
+        return list(self.documents)
+
+    def add_document(self, name, refined_text, segments=None):
+        """문서를 chunk로 나누어 기존 인덱스에 추가하고 doc_id를 반환. 이미 있는 문서면 그대로 반환."""
+        doc_id = document_fingerprint(refined_text)
+        with self._lock:
+            if doc_id in self.documents:
+                return doc_id
+            with track_stage("workspace_add"):
+                with track_step("chunking"):
+                    chunks = pipeline.split_text_into_chunks(
+                        refined_text, metadata={"source": name, "doc_id": doc_id}, segments=segments
+                    )
+                chunk_ids = [f"{doc_id}:{i}" for i in range(len(chunks))]
+                # 임베딩은 디스크 캐시를 거치므로, 단일 문서 모드나 배치로 이미 임베딩한 문서는 API 호출 없이 추가됨
+                if self.vector_db is None:
+                    self.vector_db = FAISS.from_documents(chunks, pipeline.get_embeddings(), ids=chunk_ids)
+                else:
+                    self.vector_db.add_documents(chunks, ids=chunk_ids)
+                self._reset_lexical_index()
+                with track_step("structure"):
+                    pipeline.attach_structure(self.vector_db, doc_id, RfpStructure.parse(refined_text))
+                annotate(chunks=len(chunks), documents=len(self.documents) + 1)
+            pages = [chunk.metadata["page_end"] for chunk in chunks if "page_end" in chunk.metadata]
+            self.documents[doc_id] = {"name": name, "chunk_ids": chunk_ids, "pages": max(pages, default=None)}
+        return doc_id
+
+    def remove_document(self, doc_id):
+        with self._lock:
+            entry = self.documents.pop(doc_id, None)
+            if entry is None:
+                return
+            with track_stage("workspace_remove", chunks=len(entry["chunk_ids"])):
+                # 인덱스에서 해당 chunk 벡터만 지움 (IndexFlat은 remove_ids를 지원하므로 재구성/재임베딩 불필요)
+                self.vector_db.delete(entry["chunk_ids"])
+                pipeline.detach_structure(self.vector_db, doc_id)
+                if not self.documents:
+                    self.vector_db = None
+                else:
+                    self._reset_lexical_index()
+
+    def _reset_lexical_index(self):
+        # 추가/삭제가 같은 수의 chunk로 상쇄되면 chunk 수만으로는 변경을 알 수 없으므로 직접 비움
+        self.vector_db._lexical_index = None